@@ -1,10 +1,18 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import get_dimension
+from extract import parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,8 +23,18 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_filterherstellers"
-old_index = "secondary_filterherstellers"
+workers = 4
+
+filterherstellers_query = """
+            SELECT
+                fh.id, fh.herstellerID, fh.anzahl, fh.kategorieID
+            FROM
+                filter_hersteller fh
+            WHERE
+                {range}
+            ORDER BY
+                fh.anzahl DESC
+        """
 
 
 def query():
@@ -24,6 +42,17 @@ def query():
     initial_cursor = None
 
     try:
+        if workers > 1:
+            return list(parallel_query(
+                filterherstellers_query,
+                key_column="fh.id",
+                key_table="filter_hersteller",
+                workers=workers,
+                limit_count=limit_count,
+                order_key=lambda record: record[2] or 0,
+                reverse=True
+            ))
+
         initial_db = mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
@@ -33,24 +62,7 @@ def query():
 
         initial_cursor = initial_db.cursor(prepared=True)
 
-        sql_query = """
-            SELECT
-                fh.id, h.HERSTELLERNAME, h.URLSTRUKTUR,
-                fh.anzahl,
-                k.kategorieURL, k.kategorieName
-            FROM
-                filter_hersteller fh
-            LEFT JOIN
-                hersteller h ON(h.id = fh.herstellerID)
-            LEFT JOIN
-                kategorien k ON(k.id = fh.kategorieID)
-            WHERE
-                showKategorie = 1
-            ORDER BY
-                fh.anzahl DESC
-        """
-
-
+        sql_query = serial_query(filterherstellers_query)
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -62,7 +74,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -72,7 +84,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -83,42 +95,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "HERSTELLERNAME": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "URLSTRUKTUR": {
-                    "type": "text",
-                },
-                "anzahl": {
-                    "type": "long",
-                },
-                "kategorieURL": {
-                    "type": "text",
-                },
-                "kategorieName": {
-                    "type": "text",
-                }
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'filterherstellers')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'filterherstellers'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -138,53 +119,55 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start FilterHerstellers ===========")
+filterhersteller_fields = [
+    (0, "id", "id"),
+    (1, "HERSTELLERNAME", "str"),
+    (2, "URLSTRUKTUR", "str"),
+    (3, "anzahl", "int"),
+    (4, "kategorieURL", "str"),
+    (5, "kategorieName", "str"),
+]
 
-    start_time = time.time()
+to_filterhersteller = compile_fields(filterhersteller_fields, "to_filterhersteller")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def join_dimensions(records):
+    hersteller = get_dimension("hersteller")
+    kategorien = get_dimension("kategorien")
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
-
-    filterherstellers = []
     for record in records:
-        row = {
-            "id": int(record[0]),
-            "HERSTELLERNAME": record[1] if record[1] else "",
-            "URLSTRUKTUR": record[2] if record[2] else "",
-            "anzahl": int(record[3]) if record[3] else 0,
-            "kategorieURL": record[4] if record[4] else "",
-            "kategorieName": record[5] if record[5] else "",
-        }
-
-        filterherstellers.append(row)
-
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, filterherstellers, index=ind_name)
+        k = kategorien.get(record[3])
+        if k is None or k.showKategorie != 1:
+            continue
+
+        h = hersteller.get(record[1])
+        yield (
+            record[0],
+            h.HERSTELLERNAME if h else None, h.URLSTRUKTUR if h else None,
+            record[2],
+            k.kategorieURL, k.kategorieName
+        )
+
+
+def generate_filterherstellers(records):
+    for record in join_dimensions(records):
+        yield to_filterhersteller(record)
+
+
+def main(es_object=None):
+    print("=========== Start FilterHerstellers ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('filterherstellers')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, query, generate_filterherstellers, index=ind_name, alias='filterherstellers', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(filterherstellers))
-
-    add_alias(option='filterherstellers', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='filterherstellers')
+    swap_alias(es_object, 'filterherstellers', ind_name, remove_indices=expired_generations(es_object, 'filterherstellers'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
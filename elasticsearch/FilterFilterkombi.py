@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from extract import parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,25 +22,9 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_filterkombis"
-old_index = "secondary_filterkombis"
+workers = 4
 
-
-def query():
-    initial_db = None
-    initial_cursor = None
-
-    try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
+filterkombis_query = """
             SELECT
                 fko.id, fko.title, fko.anzahl, fko.noIndex,
                 GROUP_CONCAT(fn.url ORDER BY
@@ -54,6 +45,7 @@ def query():
             LEFT JOIN
                 filter_kategorien fk ON(fk.id = fn.fkid)
             WHERE
+                {range} AND
                 fko.aktiv = 1
             GROUP BY
                 fko.id
@@ -61,6 +53,32 @@ def query():
                 fn.anzahl DESC
         """
 
+
+def query():
+    initial_db = None
+    initial_cursor = None
+
+    try:
+        if workers > 1:
+            return list(parallel_query(
+                filterkombis_query,
+                key_column="fko.id",
+                key_table="filter_kombinieren",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
+        initial_db = mysql.connector.connect(
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASS,
+            database=DATABASE
+        )
+
+        initial_cursor = initial_db.cursor(prepared=True)
+
+        sql_query = serial_query(filterkombis_query)
+
         if limit_count is not None:
             sql_query += " LIMIT %s"
             initial_cursor.execute(sql_query, (limit_count,))
@@ -71,7 +89,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -81,7 +99,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -92,42 +110,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "title": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "anzahl": {
-                    "type": "long",
-                },
-                "noIndex": {
-                    "type": "short",
-                },
-                "url": {
-                    "type": "text",
-                },
-                "kategorieURL": {
-                    "type": "text",
-                },
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'filterkombis')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'filterkombis'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -147,53 +134,37 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start filterkombis ===========")
+filterkombi_fields = [
+    (0, "id", "id"),
+    (1, "title", "str"),
+    (2, "anzahl", "int"),
+    (3, "noIndex", "int"),
+    (4, "url", "str"),
+    (5, "kategorieURL", "str"),
+]
 
-    start_time = time.time()
+to_filterkombi = compile_fields(filterkombi_fields, "to_filterkombi")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_filterkombis(records):
+    for record in records:
+        yield to_filterkombi(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    filterkombis = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "title": record[1] if record[1] else "",
-            "anzahl": int(record[2]) if record[2] else 0,
-            "noIndex": int(record[3]) if record[3] else 0,
-            "url": record[4] if record[4] else "",
-            "kategorieURL": record[5] if record[5] else ""
-        }
-
-        filterkombis.append(row)
-
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, filterkombis, index=ind_name)
+def main(es_object=None):
+    print("=========== Start filterkombis ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('filterkombis')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, query, generate_filterkombis, index=ind_name, alias='filterkombis', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(filterkombis))
-
-    add_alias(option='filterkombis', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='filterkombis')
+    swap_alias(es_object, 'filterkombis', ind_name, remove_indices=expired_generations(es_object, 'filterkombis'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import get_dimension
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,54 +22,28 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_hersteller"
-old_index = "secondary_hersteller"
 
 
 def query():
-    initial_db = None
-    initial_cursor = None
-
+    # hersteller is one of the shared dimensions, so the index is built from the cache instead of another scan
     try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
-            SELECT
-                id, HERSTELLERNAME, URLSTRUKTUR, anzahl
-            FROM
-                hersteller
-            ORDER BY
-            anzahl DESC
-        """
-
-        if limit_count is not None:
-            sql_query += " LIMIT %s"
-            initial_cursor.execute(sql_query, (limit_count,))
-        else:
-            initial_cursor.execute(sql_query)
-
-        return initial_cursor.fetchall()
-
+        hersteller = get_dimension("hersteller")
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
-    finally:
-        if initial_db and initial_db.is_connected():
-            initial_cursor.close()
-            initial_db.close()
+    records = [
+        (hersteller_id, h.HERSTELLERNAME, h.URLSTRUKTUR, h.anzahl)
+        for hersteller_id, h in hersteller.items()
+    ]
+    records.sort(key=lambda record: -(record[3] or 0))
+
+    return records[:limit_count] if limit_count is not None else records
 
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -73,36 +54,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "HERSTELLERNAME": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "URLSTRUKTUR": {
-                    "type": "text",
-                },
-                "anzahl": {
-                    "type": "long",
-                }
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'hersteller')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'hersteller'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -122,51 +78,35 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Hersteller ===========")
+hersteller_fields = [
+    (0, "id", "id"),
+    (1, "HERSTELLERNAME", "str"),
+    (2, "URLSTRUKTUR", "str"),
+    (3, "anzahl", "int"),
+]
 
-    start_time = time.time()
+to_hersteller = compile_fields(hersteller_fields, "to_hersteller")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_hersteller(records):
+    for record in records:
+        yield to_hersteller(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    hersteller = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "HERSTELLERNAME": record[1] if record[1] else "",
-            "URLSTRUKTUR": record[2] if record[2] else "",
-            "anzahl": int(record[3]) if record[3] else 0
-        }
+def main(es_object=None):
+    print("=========== Start Hersteller ===========")
 
-        hersteller.append(row)
+    es_object = es_object or connect_elasticsearch()
 
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+    ind_name = new_generation('hersteller')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, hersteller, index=ind_name)
+    imported, _ = run_pipeline(es_object, query, generate_hersteller, index=ind_name, alias='hersteller', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(hersteller))
-
-    add_alias(option='hersteller', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='hersteller')
+    swap_alias(es_object, 'hersteller', ind_name, remove_indices=expired_generations(es_object, 'hersteller'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -1,10 +1,20 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
+import sys
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import get_dimension
+from extract import parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from snapshot import cached_query
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,8 +25,23 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_herstellerfilters"
-old_index = "secondary_herstellerfilters"
+workers = 4
+
+herstellerfilters_query = """
+            SELECT
+                fn.id, fn.title, fn.anzeige, fn.url, fn.filterURL, fn.anzeigeKategorie fnAnzeigeKategorie, fn.noIndex noIndexFN,
+                fn.fkid, f2h.herstellerID, f2h.anzahl
+            FROM
+                filter_namen fn
+            LEFT JOIN
+                filter2hersteller_anzahl f2h ON(f2h.filterID = fn.id)
+            WHERE
+                {range}
+            ORDER BY
+                fn.anzahl DESC
+        """
+
+herstellerfilters_tables = ["filter_namen", "filter2hersteller_anzahl"]
 
 
 def query():
@@ -24,6 +49,15 @@ def query():
     initial_cursor = None
 
     try:
+        if workers > 1:
+            return list(parallel_query(
+                herstellerfilters_query,
+                key_column="fn.id",
+                key_table="filter_namen",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
         initial_db = mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
@@ -33,29 +67,7 @@ def query():
 
         initial_cursor = initial_db.cursor(prepared=True)
 
-        sql_query = """
-            SELECT
-                fn.id, fn.title, fn.anzeige, fn.url, fn.filterURL, fn.anzeigeKategorie fnAnzeigeKategorie, fn.noIndex noIndexFN,
-                fk.name, fk.anzeigeKategorie fkAnzeigeKategorie, fk.noIndex noIndexFK,
-                h.HERSTELLERNAME, h.URLSTRUKTUR,
-                f2h.anzahl,
-                k.kategorieURL, k.kategorieName
-            FROM
-                filter_namen fn
-            LEFT JOIN
-                filter_kategorien fk ON(fk.id = fn.fkid)
-            LEFT JOIN
-                filter2hersteller_anzahl f2h ON(f2h.filterID = fn.id)
-            LEFT JOIN
-                hersteller h ON(h.id = f2h.herstellerID)
-            LEFT JOIN
-                kategorien k ON(k.id = fk.kategorieID)
-            WHERE
-                showKategorie = 1
-            ORDER BY
-                fn.anzahl DESC
-        """
-
+        sql_query = serial_query(herstellerfilters_query)
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -67,7 +79,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -75,9 +87,13 @@ def query():
             initial_db.close()
 
 
+def snapshot_records():
+    return cached_query('herstellerfilters', [herstellerfilters_query, limit_count], herstellerfilters_tables, query)
+
+
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -88,73 +104,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-
-                "title": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "anzeige": {
-                    "type": "text",
-                },
-                "url": {
-                    "type": "text",
-                },
-                "filterURL": {
-                    "type": "text",
-                },
-                "fnAnzeigeKategorie": {
-                    "type": "short",
-                },
-                "noIndexFN": {
-                    "type": "short",
-                },
-                "name": {
-                    "type": "text",
-                },
-                "fkAnzeigeKategorie": {
-                    "type": "short",
-                },
-                "noIndexFK": {
-                    "type": "short",
-                },
-                "HERSTELLERNAME": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "URLSTRUKTUR": {
-                    "type": "text",
-                },
-                "anzahl": {
-                    "type": "long",
-                },
-                "kategorieURL": {
-                    "type": "text",
-                },
-                "kategorieName": {
-                    "type": "text",
-                }
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'herstellerfilters')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'herstellerfilters'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -174,62 +128,66 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start HerstellerFilters ===========")
+herstellerfilter_fields = [
+    (0, "id", "id"),
+    (1, "Title", "str"),
+    (2, "anzeige", "str"),
+    (3, "url", "str"),
+    (4, "filterURL", "str"),
+    (5, "fnAnzeigeKategorie", "int"),
+    (6, "noIndexFN", "int"),
+    (7, "name", "str"),
+    (8, "fkAnzeigeKategorie", "int"),
+    (9, "noIndexFK", "int"),
+    (10, "HERSTELLERNAME", "str"),
+    (11, "URLSTRUKTUR", "str"),
+    (12, "anzahl", "int"),
+    (13, "kategorieURL", "str"),
+    (14, "kategorieName", "str"),
+]
+
+to_herstellerfilter = compile_fields(herstellerfilter_fields, "to_herstellerfilter")
+
+
+def join_dimensions(records):
+    filter_kategorien = get_dimension("filter_kategorien")
+    kategorien = get_dimension("kategorien")
+    hersteller = get_dimension("hersteller")
 
-    start_time = time.time()
+    for record in records:
+        fk = filter_kategorien.get(record[7])
+        k = kategorien.get(fk.kategorieID) if fk else None
+        if k is None or k.showKategorie != 1:
+            continue
+
+        h = hersteller.get(record[8])
+        yield tuple(record[:7]) + (
+            fk.name, fk.anzeigeKategorie, fk.noIndex,
+            h.HERSTELLERNAME if h else None, h.URLSTRUKTUR if h else None,
+            record[9],
+            k.kategorieURL, k.kategorieName
+        )
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_herstellerfilters(records):
+    for record in join_dimensions(records):
+        yield to_herstellerfilter(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    herstellerfilters = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "Title": record[1] if record[1] else "",
-            "anzeige": record[2] if record[2] else "",
-            "url": record[3] if record[3] else "",
-            "filterURL": record[4] if record[4] else "",
-            "fnAnzeigeKategorie": int(record[5]) if record[5] else 0,
-            "noIndexFN": int(record[6]) if record[6] else 0,
-            "name": record[7] if record[7] else "",
-            "fkAnzeigeKategorie": int(record[8]) if record[8] else 0,
-            "noIndexFK": int(record[9]) if record[9] else 0,
-            "HERSTELLERNAME": record[10] if record[10] else "",
-            "URLSTRUKTUR": record[11] if record[11] else "",
-            "anzahl": int(record[12]) if record[12] else 0,
-            "kategorieURL": record[13] if record[13] else "",
-            "kategorieName": record[14] if record[14] else "",
-        }
-
-        herstellerfilters.append(row)
-
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, herstellerfilters, index=ind_name)
+def main(snapshot=False, es_object=None):
+    print("=========== Start HerstellerFilters ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('herstellerfilters')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, snapshot_records if snapshot else query, generate_herstellerfilters, index=ind_name, alias='herstellerfilters')
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(herstellerfilters))
-
-    add_alias(option='herstellerfilters', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='herstellerfilters')
+    swap_alias(es_object, 'herstellerfilters', ind_name, remove_indices=expired_generations(es_object, 'herstellerfilters'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -238,4 +196,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(snapshot='--snapshot' in sys.argv)
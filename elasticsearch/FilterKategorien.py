@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import get_dimension
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,56 +22,29 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_kategorien"
-old_index = "secondary_kategorien"
 
 
 def query():
-    initial_db = None
-    initial_cursor = None
-
+    # kategorien is one of the shared dimensions, so the index is built from the cache instead of another scan
     try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
-              SELECT
-                id, kategorieURL, kategorieName, catNoIndex
-              FROM
-                kategorien
-              WHERE
-                showKategorie = 1
-              ORDER BY
-                kategorieName ASC
-        """
-
-        if limit_count is not None:
-            sql_query += " LIMIT %s"
-            initial_cursor.execute(sql_query, (limit_count,))
-        else:
-            initial_cursor.execute(sql_query)
-
-        return initial_cursor.fetchall()
-
+        kategorien = get_dimension("kategorien")
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
-    finally:
-        if initial_db and initial_db.is_connected():
-            initial_cursor.close()
-            initial_db.close()
+    records = [
+        (kategorie_id, k.kategorieURL, k.kategorieName, k.catNoIndex)
+        for kategorie_id, k in kategorien.items()
+        if k.showKategorie == 1
+    ]
+    records.sort(key=lambda record: (record[2] or "").lower())
+
+    return records[:limit_count] if limit_count is not None else records
 
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -75,36 +55,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "kategorieURL": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "kategorieName": {
-                    "type": "text",
-                },
-                "catNoIndex": {
-                    "type": "short",
-                }
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'kategorien')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'kategorien'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -124,51 +79,35 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Kategorien ===========")
+kategorie_fields = [
+    (0, "id", "id"),
+    (1, "kategorieURL", "str"),
+    (2, "kategorieName", "str"),
+    (3, "catNoIndex", "int"),
+]
 
-    start_time = time.time()
+to_kategorie = compile_fields(kategorie_fields, "to_kategorie")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_kategorien(records):
+    for record in records:
+        yield to_kategorie(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    kategorien = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "kategorieURL": record[1] if record[1] else "",
-            "kategorieName": record[2] if record[2] else "",
-            "catNoIndex": int(record[3]) if record[3] else 0
-        }
+def main(es_object=None):
+    print("=========== Start Kategorien ===========")
 
-        kategorien.append(row)
+    es_object = es_object or connect_elasticsearch()
 
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+    ind_name = new_generation('kategorien')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, kategorien, index=ind_name)
+    imported, _ = run_pipeline(es_object, query, generate_kategorien, index=ind_name, alias='kategorien', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(kategorien))
-
-    add_alias(option='kategorien', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='kategorien')
+    swap_alias(es_object, 'kategorien', ind_name, remove_indices=expired_generations(es_object, 'kategorien'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from extract import get_connection, get_pool
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,25 +22,8 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_filtermagazines"
-old_index = "secondary_filtermagazines"
 
-
-def query():
-    initial_db = None
-    initial_cursor = None
-
-    try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
+filtermagazines_query = """
             SELECT
                 tt.id, tt.testerURL, tt.testerName,
                 COUNT(t.TESTID) anz
@@ -49,6 +39,18 @@ def query():
                 tt.testerName ASC
         """
 
+
+def query():
+    initial_db = None
+    initial_cursor = None
+
+    try:
+        initial_db = get_connection(get_pool(1))
+
+        initial_cursor = initial_db.cursor(prepared=True)
+
+        sql_query = filtermagazines_query
+
         if limit_count is not None:
             sql_query += " LIMIT %s"
             initial_cursor.execute(sql_query, (limit_count,))
@@ -59,7 +61,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -69,7 +71,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -80,36 +82,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "testerURL": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "testerName": {
-                    "type": "text",
-                },
-                "anz": {
-                    "type": "long",
-                },
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'filtermagazines')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'filtermagazines'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -129,51 +106,35 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start filtermagazines ===========")
+filtermagazine_fields = [
+    (0, "id", "id"),
+    (1, "testerURL", "str"),
+    (2, "testerName", "str"),
+    (3, "anz", "int"),
+]
 
-    start_time = time.time()
+to_filtermagazine = compile_fields(filtermagazine_fields, "to_filtermagazine")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_filtermagazines(records):
+    for record in records:
+        yield to_filtermagazine(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    filtermagazines = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "testerURL": record[1] if record[1] else "",
-            "testerName": record[2] if record[2] else "",
-            "anz": int(record[3]) if record[3] else 0,
-        }
+def main(es_object=None):
+    print("=========== Start filtermagazines ===========")
 
-        filtermagazines.append(row)
+    es_object = es_object or connect_elasticsearch()
 
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+    ind_name = new_generation('filtermagazines')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, filtermagazines, index=ind_name)
+    imported, _ = run_pipeline(es_object, query, generate_filtermagazines, index=ind_name, alias='filtermagazines', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(filtermagazines))
-
-    add_alias(option='filtermagazines', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='filtermagazines')
+    swap_alias(es_object, 'filtermagazines', ind_name, remove_indices=expired_generations(es_object, 'filtermagazines'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from extract import get_connection, get_pool
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,25 +22,8 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_testreihes"
-old_index = "secondary_testreihes"
 
-
-def query():
-    initial_db = None
-    initial_cursor = None
-
-    try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
+testreihes_query = """
             SELECT
                 tr.id, tr.ueberschrift, tr.noIndex,
                 tt.testerURL,
@@ -54,6 +44,18 @@ def query():
                 tr.ueberschrift ASC
         """
 
+
+def query():
+    initial_db = None
+    initial_cursor = None
+
+    try:
+        initial_db = get_connection(get_pool(1))
+
+        initial_cursor = initial_db.cursor(prepared=True)
+
+        sql_query = testreihes_query
+
         if limit_count is not None:
             sql_query += " LIMIT %s"
             initial_cursor.execute(sql_query, (limit_count,))
@@ -64,7 +66,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -74,7 +76,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -85,42 +87,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "ueberschrift": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "noIndex": {
-                    "type": "long",
-                },
-                "testerURL": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "anzahl": {
-                    "type": "long",
-                },
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'testreihes')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'testreihes'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -140,52 +111,36 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start testreihes ===========")
+testreihe_fields = [
+    (0, "id", "id"),
+    (1, "ueberschrift", "str"),
+    (2, "noIndex", "int"),
+    (3, "testerURL", "str"),
+    (4, "anzahl", "int"),
+]
 
-    start_time = time.time()
+to_testreihe = compile_fields(testreihe_fields, "to_testreihe")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_testreihes(records):
+    for record in records:
+        yield to_testreihe(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    testreihes = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "ueberschrift": record[1] if record[1] else "",
-            "noIndex": int(record[2]) if record[2] else 0,
-            "testerURL": record[3] if record[3] else "",
-            "anzahl": int(record[4]) if record[4] else 0
-        }
+def main(es_object=None):
+    print("=========== Start testreihes ===========")
 
-        testreihes.append(row)
+    es_object = es_object or connect_elasticsearch()
 
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+    ind_name = new_generation('testreihes')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, testreihes, index=ind_name)
+    imported, _ = run_pipeline(es_object, query, generate_testreihes, index=ind_name, alias='testreihes', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(testreihes))
-
-    add_alias(option='testreihes', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='testreihes')
+    swap_alias(es_object, 'testreihes', ind_name, remove_indices=expired_generations(es_object, 'testreihes'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -1,35 +1,129 @@
-import json
+import time
+import threading
 
-import requests
 
+# set by defer_swaps(): swaps are collected there instead of being made, commit_swaps() then moves
+# every collected alias in one request, e.g. all 15 after a full cycle
+deferred = None
+lock = threading.Lock()
 
-def add_alias(option, add_index):
-    request_url = 'https://search.testbericht.de/_aliases'
+# set in the mapping _meta of an index when it is swapped in; generations.py only counts marked
+# indices, a load that failed before its swap must neither be kept nor rolled back to
+live_key = "live"
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
 
-    data = json.dumps({
-        "actions": [
-            {"add": {"index": add_index, "alias": option}}
-        ]
-    })
+def alias_indices(es_object, aliases):
+    # alias -> indices it points to now, one request for all of them
+    response = es_object.indices.get_alias(name=",".join(aliases), ignore=404)
+    return current_indices(response, aliases)
 
-    requests.request("POST", request_url, headers=headers, data=data)
 
+def current_indices(response, aliases):
+    current = {alias: [] for alias in aliases}
+    for index, entry in response.items():
+        if not isinstance(entry, dict):
+            continue
+        for alias in entry.get("aliases", {}):
+            if alias in current:
+                current[alias].append(index)
+    return current
 
-def remove_alias(option, remove_index):
-    request_url = 'https://search.testbericht.de/_aliases'
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
+def swap_actions(current, swaps):
+    actions = []
+    for alias, indices in current.items():
+        for index in indices:
+            if index != swaps[alias]:
+                actions.append({"remove": {"index": index, "alias": alias}})
+        actions.append({"add": {"index": swaps[alias], "alias": alias}})
+    return actions
 
-    data = json.dumps({
-        "actions": [
-            {"remove": {"index": remove_index, "alias": option}},
-        ]
-    })
 
-    requests.request("POST", request_url, headers=headers, data=data)
+def live_mappings(response, indices):
+    # index -> put_mapping body; put_mapping replaces the whole _meta, the template hash in it is kept
+    bodies = {}
+    for index in indices:
+        meta = dict(response.get(index, {}).get("mappings", {}).get("_meta", {}))
+        meta[live_key] = True
+        bodies[index] = {"_meta": meta}
+    return bodies
+
+
+def mark_live(es_object, indices):
+    response = es_object.indices.get_mapping(index=",".join(indices), filter_path="*.mappings._meta")
+    for index, body in live_mappings(response, indices).items():
+        es_object.indices.put_mapping(index=index, body=body)
+
+
+def swap_aliases(es_object, swaps, remove_indices=()):
+    # swaps is {alias: new index}; every alias is moved with add and remove in one _aliases request,
+    # so searches see either all old or all new indices and never both under one alias. The
+    # remove_indices are deleted only after that
+    start_time = time.time()
+
+    # marked first, the indices are loaded and green by now; marked after the swap, a failed
+    # put_mapping would leave a live index that retention does not know about
+    mark_live(es_object, list(swaps.values()))
+    actions = swap_actions(alias_indices(es_object, list(swaps)), swaps)
+    es_object.indices.update_aliases(body={"actions": actions})
+    swap_time = time.time()
+
+    remove_indices = [index for index in remove_indices if index not in swaps.values()]
+    if remove_indices:
+        es_object.indices.delete(index=",".join(remove_indices), ignore=[400, 404])
+
+    print("--- Alias swap {}: {:10.3f} seconds ---".format(", ".join(swaps), swap_time - start_time))
+    return actions
+
+
+def swap_alias(es_object, alias, add_index, remove_indices=(), after_swap=None):
+    # after_swap is called once the alias points to add_index, e.g. to save the delta mark of the
+    # load; with deferred swaps that is in commit_swaps(), and never if they are discarded
+    remove_indices = list(remove_indices)
+
+    with lock:
+        if deferred is not None:
+            deferred[alias] = (add_index, remove_indices, after_swap)
+            return None
+
+    actions = swap_aliases(es_object, {alias: add_index}, remove_indices)
+    if after_swap is not None:
+        after_swap()
+    return actions
+
+
+def defer_swaps():
+    global deferred
+    with lock:
+        deferred = {}
+
+
+def commit_swaps(es_object):
+    global deferred
+    with lock:
+        collected = deferred or {}
+        deferred = None
+
+    if not collected:
+        return None
+
+    swaps = {alias: add_index for alias, (add_index, _, _) in collected.items()}
+    remove_indices = [index for _, indices, _ in collected.values() for index in indices]
+    actions = swap_aliases(es_object, swaps, remove_indices)
+    for _, _, after_swap in collected.values():
+        if after_swap is not None:
+            after_swap()
+    return actions
+
+
+def discard_swaps():
+    # the collected swaps are dropped, the aliases stay where they are
+    global deferred
+    with lock:
+        collected = deferred or {}
+        deferred = None
+    return collected
+
+
+def remove_alias(es_object, alias, remove_index):
+    es_object.indices.update_aliases(body={"actions": [{"remove": {"index": remove_index, "alias": alias}}]})
@@ -1,10 +1,17 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from extract import get_connection, get_pool
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -18,8 +25,18 @@ TYPESENSE_HOST = os.environ.get("TYPESENSE_HOST")
 TYPESENSE_KEY = os.environ.get("TYPESENSE_KEY")
 
 limit_count = None
-new_index = "primary_categories"
-old_index = "secondary_categories"
+
+categories_query = """
+            SELECT
+                CONCAT(h.name, ' ', k.week_id) title, CONCAT('/', k.id, '/', h.password,
+                '/') url, fh.name img
+            FROM
+                agents fh
+            LEFT JOIN
+                zones h ON(h.id = fh.zone_id)
+            LEFT JOIN
+                sales k ON(fh.id = k.agent_id)
+        """
 
 
 def query():
@@ -27,12 +44,9 @@ def query():
     initial_cursor = None
 
     try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
+        # a connection of the shared pool, waits while other tasks hold it; a resident process does not
+        # log in again for every run
+        initial_db = get_connection(get_pool(1))
 
         initial_cursor = initial_db.cursor(prepared=True)
 
@@ -52,17 +66,7 @@ def query():
         #         k.kategorieName ASC
         # """
 
-        sql_query = """
-            SELECT
-                CONCAT(h.name, ' ', k.week_id) title, CONCAT('/', k.id, '/', h.password,
-                '/') url, fh.name img
-            FROM
-                agents fh
-            LEFT JOIN
-                zones h ON(h.id = fh.zone_id)
-            LEFT JOIN
-                sales k ON(fh.id = k.agent_id)
-        """
+        sql_query = categories_query
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -74,7 +78,8 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        # an empty result would be loaded and swapped live, the failed read has to stop the run
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -84,7 +89,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, bulk_size=3000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -97,7 +102,9 @@ def create_index(es_object, index_name):
 
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'categories')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'categories'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -117,59 +124,34 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Categories ===========")
+category_fields = [
+    (0, "title", "bytes"),
+    (1, "url", "bytes"),
+    (2, "img", "bytes"),
+]
 
-    start_time = time.time()
+to_category = compile_fields(category_fields, "to_category")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_categories(records):
+    for record in records:
+        yield to_category(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    categories = []
-    index = 0
-    for record in records:
-        index = index + 1
-        print(index)
-        print(record[0])
-        print(record[1])
-        print(record[2])
-        print(record[0].decode())
-        print(record[1].decode())
-        print(record[2].decode())
-        row = {
-            "title": record[0].decode() if record[0] else "",
-            "url": record[1].decode() if record[1] else "",
-            "img": record[2].decode() if record[2] else "",
-        }
-
-        categories.append(row)
-    print(categories)
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, categories, index=ind_name)
+def main(es_object=None):
+    print("=========== Start Categories ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('categories')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, query, generate_categories, index=ind_name, alias='categories')
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(categories))
-
-    add_alias(option='categories', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='categories')
+    swap_alias(es_object, 'categories', ind_name, remove_indices=expired_generations(es_object, 'categories'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+
+from elasticsearch7 import Elasticsearch
+from dotenv import load_dotenv
+
+from delta import delta_actions, load_mark, save_mark
+from dimensions import dimension_queries, invalidate
+from extract import fetch_all, fetch_ids
+from indexers import load_script
+from loader import parallel_bulk
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+DB_HOST = os.environ.get("DB_HOST")
+DB_PORT = int(os.environ.get("DB_PORT", 3306))
+DB_USER = os.environ.get("DB_USER")
+DB_PASS = os.environ.get("DB_PASS")
+DATABASE = os.environ.get("DB_DATABASE")
+
+# the binlog position is saved about once a second, apart from the marks of the batch loads
+state_path = os.path.join(os.path.dirname(__file__), 'cdc_state.json')
+
+flush_interval = 1.0
+flush_size = 1000
+
+# alias -> (script, query with {range}, key column, document generator)
+targets = {
+    "items": ("getAllItems", "items_query", "p.id", "generate_items"),
+    "products": ("product", "products_query", "pm.id", "generate_products"),
+    "prices": ("price", "prices_query", "produktID", "generate_prices"),
+    "keywords": ("keyword", "keywords_query", "fn.id", "generate_keywords"),
+    "filters": ("FilterFilter", "filters_query", "fn.id", "generate_filters"),
+}
+
+# table -> [(column of the changed row, lookup query from that value to document ids or None, aliases)]
+routes = {
+    "pname2pid_mapping": [
+        ("id", None, ("items", "products")),
+    ],
+    "pname2pid_angebote": [
+        ("produktID", None, ("items", "products", "prices")),
+    ],
+    "tbmeinungen": [
+        ("produktID", None, ("items",)),
+    ],
+    "meinungen_amazon_stars": [
+        ("produktID", None, ("items",)),
+    ],
+    "meinungen_otto_stars": [
+        ("produktID", None, ("items",)),
+    ],
+    "hersteller": [
+        ("id", "SELECT id FROM pname2pid_mapping WHERE herstellerID = %s", ("items", "products")),
+    ],
+    "kategorien": [
+        ("id", "SELECT id FROM pname2pid_mapping WHERE kategorieID = %s", ("items", "products")),
+        ("id", "SELECT fn.id FROM filter_namen fn INNER JOIN filter_kategorien fk ON(fk.id = fn.fkid) WHERE fk.kategorieID = %s", ("keywords", "filters")),
+    ],
+    "filter_kategorien": [
+        ("id", "SELECT id FROM filter_namen WHERE fkid = %s", ("keywords", "filters")),
+    ],
+    "filter_namen": [
+        ("id", None, ("keywords", "filters")),
+    ],
+}
+
+
+class EventSource:
+    # events() yields {"table", "before", "after", "position"} dicts and None whenever the source is idle
+
+    def events(self):
+        raise NotImplementedError
+
+    def commit(self, position):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileEventSource(EventSource):
+    # replays events written one JSON object per line, e.g. captured from production for tests
+
+    def __init__(self, path, follow=False):
+        self.path = path
+        self.follow = follow
+
+    def events(self):
+        with open(self.path) as event_file:
+            while True:
+                line = event_file.readline()
+                if line.strip():
+                    yield json.loads(line)
+                elif line:
+                    continue
+                elif self.follow:
+                    yield None
+                    time.sleep(flush_interval)
+                else:
+                    return
+
+
+class BinlogEventSource(EventSource):
+    # needs row based binlogs and the mysql-replication package
+
+    def __init__(self, server_id=4711):
+        from pymysqlreplication import BinLogStreamReader
+        from pymysqlreplication.event import HeartbeatLogEvent
+        from pymysqlreplication.row_event import DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent
+
+        self.heartbeat_event = HeartbeatLogEvent
+        self.update_event = UpdateRowsEvent
+        self.delete_event = DeleteRowsEvent
+
+        # positions saved before cdc had its own state file are still picked up once
+        position = load_mark("cdc", state_path) or load_mark("cdc") or {}
+
+        self.stream = BinLogStreamReader(
+            connection_settings={"host": DB_HOST, "port": DB_PORT, "user": DB_USER, "passwd": DB_PASS},
+            server_id=server_id,
+            only_schemas=[DATABASE],
+            only_tables=list(routes),
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, HeartbeatLogEvent],
+            blocking=True,
+            resume_stream=bool(position),
+            log_file=position.get("log_file"),
+            log_pos=position.get("log_pos"),
+            slave_heartbeat=flush_interval
+        )
+
+    def events(self):
+        for binlog_event in self.stream:
+            if isinstance(binlog_event, self.heartbeat_event):
+                yield None
+                continue
+
+            position = {"log_file": self.stream.log_file, "log_pos": self.stream.log_pos}
+            for row in binlog_event.rows:
+                if isinstance(binlog_event, self.update_event):
+                    before, after = row["before_values"], row["after_values"]
+                elif isinstance(binlog_event, self.delete_event):
+                    before, after = row["values"], None
+                else:
+                    before, after = None, row["values"]
+
+                yield {"table": binlog_event.table, "before": before, "after": after, "position": position}
+
+    def commit(self, position):
+        save_mark("cdc", position, state_path)
+
+    def close(self):
+        self.stream.close()
+
+
+def connect_elasticsearch():
+    _es = None
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500)
+    if _es.ping():
+        print('Connect to Elasticsearch')
+    else:
+        print('it could not connect!')
+    return _es
+
+
+def route(event, pending):
+    if event["table"] in dimension_queries:
+        invalidate(event["table"])
+
+    for column, lookup, aliases in routes.get(event["table"], []):
+        # both row images, so a row moving to another product or category updates old and new
+        values = set()
+        for image in (event.get("before"), event.get("after")):
+            if image and image.get(column) is not None:
+                values.add(int(image[column]))
+
+        ids = set()
+        for value in values:
+            if lookup is None:
+                ids.add(value)
+            else:
+                ids.update(int(record[0]) for record in fetch_all(lookup, (value,)))
+
+        for alias in aliases:
+            pending.setdefault(alias, set()).update(ids)
+
+
+def flush(es_object, pending):
+    updated = 0
+
+    for alias, changed in pending.items():
+        if not changed:
+            continue
+
+        script, query_name, key_column, generator_name = targets[alias]
+        module = load_script(script)
+
+        records = fetch_ids(getattr(module, query_name), key_column, changed)
+        documents = getattr(module, generator_name)(records)
+        # documents that are rejected for good go to the dead letters, raising here would keep the
+        # position from being committed and replay the same events forever
+        success, _ = parallel_bulk(es_object, delta_actions(alias, changed, documents), alias=alias, ignore_status=(404,))
+        updated += success
+
+    return updated
+
+
+def consume(source, es_object):
+    pending = {}
+    pending_count = 0
+    position = None
+    last_flush = time.time()
+
+    try:
+        for event in source.events():
+            if event is not None:
+                route(event, pending)
+                pending_count += 1
+                position = event.get("position", position)
+
+            if pending_count and (event is None or pending_count >= flush_size or time.time() - last_flush >= flush_interval):
+                start_time = time.time()
+                updated = flush(es_object, pending)
+                source.commit(position)
+                print("--- Applied {} events, {} documents in {:.2f} seconds ---".format(pending_count, updated, time.time() - start_time))
+                pending = {}
+                pending_count = 0
+                last_flush = time.time()
+
+        if pending_count:
+            updated = flush(es_object, pending)
+            source.commit(position)
+            print("--- Applied {} events, {} documents ---".format(pending_count, updated))
+    finally:
+        source.close()
+
+
+def main():
+    print("=========== Start CDC ===========")
+
+    es_object = connect_elasticsearch()
+
+    if "--replay" in sys.argv:
+        source = FileEventSource(sys.argv[sys.argv.index("--replay") + 1])
+    else:
+        source = BinlogEventSource()
+
+    consume(source, es_object)
+
+    print("============ End CDC ===========")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import os
+import json
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+from orchestrator import connect_elasticsearch, max_parallel, run_task, tasks
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+# run status as JSON on http://<status_host>:<status_port>/
+STATUS_HOST = os.environ.get("DAEMON_STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.environ.get("DAEMON_STATUS_PORT", "8089"))
+
+# seconds between two runs of a task, or "HH:MM" for once a day at that local time
+default_cadence = 3600
+cadences = {
+    "dimensions": 900,
+    "prices": 300,
+    "items": "02:00",
+    "herstellerfilters": "03:00",
+}
+
+# arguments for the script's main(); the frequent price runs only send what changed since the last one
+task_arguments = {
+    "prices": {"delta": True},
+}
+
+# finished runs kept per task for the status
+history = 20
+
+tick_seconds = 5
+
+
+class Schedule:
+    # state of one task, read by the status handler while the scheduler thread updates it
+
+    def __init__(self, name, cadence):
+        self.name = name
+        self.cadence = cadence
+        self.running = None
+        self.next_run = self.following(datetime.now(), first=True)
+        self.runs = deque(maxlen=history)
+
+    def following(self, after, first=False):
+        if isinstance(self.cadence, str):
+            hour, minute = (int(part) for part in self.cadence.split(":"))
+            at = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            return at if at > after else at + timedelta(days=1)
+        # interval tasks run once right after the start, the warm pools are worth nothing without data
+        return after if first else after + timedelta(seconds=self.cadence)
+
+    def status(self):
+        last = self.runs[-1] if self.runs else None
+        return {
+            "cadence": self.cadence,
+            "running_since": self.running,
+            "next_run": self.next_run,
+            "last_status": last["status"] if last else None,
+            "runs": list(self.runs),
+        }
+
+
+class Daemon:
+
+    def __init__(self, parallel=max_parallel):
+        self.parallel = parallel
+        self.schedules = {name: Schedule(name, cadences.get(name, default_cadence)) for name in tasks}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.started = datetime.now()
+        # one client and the module-level MySQL pools of extract.py stay open for every run
+        self.es_object = connect_elasticsearch(parallel)
+
+    def due(self, now):
+        # a task whose dependencies are running waits for them, the dimensions are shared
+        with self.lock:
+            running = {name for name, schedule in self.schedules.items() if schedule.running}
+            return [
+                schedule for schedule in self.schedules.values()
+                if not schedule.running and schedule.next_run <= now and not running & set(tasks[schedule.name][1])
+            ]
+
+    def execute(self, schedule):
+        run = {"start": datetime.now(), "seconds": None, "status": "ok", "error": None}
+        try:
+            run["seconds"] = run_task(schedule.name, self.es_object, **task_arguments.get(schedule.name, {}))
+        except Exception as ex:
+            print("{} failed: {}".format(schedule.name, ex))
+            run["status"] = "failed"
+            run["error"] = str(ex)
+            run["seconds"] = (datetime.now() - run["start"]).total_seconds()
+
+        with self.lock:
+            schedule.running = None
+            schedule.runs.append(run)
+            # the next interval counts from the start, a run that took longer than its cadence starts again right away
+            schedule.next_run = max(datetime.now(), schedule.following(run["start"]))
+        print("--- {}: {} in {:10.1f} seconds, next run {:%Y-%m-%d %H:%M:%S} ---".format(
+            schedule.name, run["status"], run["seconds"], schedule.next_run
+        ))
+
+    def status(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "parallel": self.parallel,
+                "tasks": {name: schedule.status() for name, schedule in self.schedules.items()},
+            }
+
+    def serve(self):
+        daemon = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = json.dumps(daemon.status(), default=str, indent=2).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((STATUS_HOST, STATUS_PORT), StatusHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("Status on http://{}:{}/".format(STATUS_HOST, STATUS_PORT))
+        return server
+
+    def run(self):
+        server = self.serve()
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            while not self.stopped.is_set():
+                now = datetime.now()
+                with self.lock:
+                    slots = self.parallel - sum(1 for schedule in self.schedules.values() if schedule.running)
+                # the longest overdue first, the global limit of the orchestrator holds here as well
+                for schedule in sorted(self.due(now), key=lambda schedule: schedule.next_run)[:max(slots, 0)]:
+                    with self.lock:
+                        schedule.running = now
+                    print("--- Start {} ---".format(schedule.name))
+                    executor.submit(self.execute, schedule)
+
+                self.stopped.wait(tick_seconds)
+
+            print("Stopping, waiting for the running tasks")
+        server.shutdown()
+
+    def stop(self, *args):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    daemon = Daemon()
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
@@ -0,0 +1,81 @@
+import os
+import json
+import fcntl
+import tempfile
+
+from extract import fetch_all
+
+state_path = os.path.join(os.path.dirname(__file__), 'delta_state.json')
+
+# rows committed late can carry a timestamp just below the mark, so every run looks back a bit
+overlap_seconds = 60
+
+
+def load_mark(alias, path=state_path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as state_file:
+        return json.load(state_file).get(alias)
+
+
+def save_mark(alias, mark, path=state_path):
+    # the daemon, the orchestrator and cdc each save their own marks, the lock keeps one from
+    # writing back a state it read before another one's save
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        state = {}
+        if os.path.exists(path):
+            with open(path) as state_file:
+                state = json.load(state_file)
+
+        state[alias] = mark
+
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), prefix=os.path.basename(path),
+                                         suffix='.tmp', delete=False) as state_file:
+            json.dump(state, state_file, indent=2)
+        try:
+            os.replace(state_file.name, path)
+        except OSError:
+            os.unlink(state_file.name)
+            raise
+
+
+def current_mark():
+    records = fetch_all("SELECT NOW() - INTERVAL %s SECOND", (overlap_seconds,))
+    mark = records[0][0]
+    return mark.decode() if isinstance(mark, (bytes, bytearray)) else str(mark)
+
+
+def changed_ids(changed_query, mark):
+    return set(int(record[0]) for record in fetch_all(changed_query, (mark,) * changed_query.count("%s")))
+
+
+def keyed_actions(documents):
+    # full rebuilds use the same _id as the delta upserts, so both write to one document per row
+    for document in documents:
+        document["_id"] = document["id"]
+        yield document
+
+
+def delta_actions(alias, changed, documents):
+    # changed ids that no longer come back from the index query were blocked (gesperrt) or removed
+    seen = set()
+
+    for document in documents:
+        seen.add(document["id"])
+        yield {
+            "_op_type": "update",
+            "_index": alias,
+            "_id": document["id"],
+            "doc": document,
+            "doc_as_upsert": True,
+        }
+
+    for removed_id in changed - seen:
+        yield {
+            "_op_type": "delete",
+            "_index": alias,
+            "_id": removed_id,
+        }
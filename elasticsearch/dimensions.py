@@ -0,0 +1,65 @@
+import threading
+from collections import namedtuple
+
+from extract import fetch_all
+
+Kategorie = namedtuple("Kategorie", "kategorieURL kategorieName showKategorie catNoIndex")
+Hersteller = namedtuple("Hersteller", "HERSTELLERNAME URLSTRUKTUR anzahl")
+FilterKategorie = namedtuple("FilterKategorie", "name anzeigeKategorie noIndex kategorieID sort")
+
+dimension_queries = {
+    "kategorien": (
+        "SELECT id, kategorieURL, kategorieName, showKategorie, catNoIndex FROM kategorien",
+        Kategorie
+    ),
+    "hersteller": (
+        "SELECT id, HERSTELLERNAME, URLSTRUKTUR, anzahl FROM hersteller",
+        Hersteller
+    ),
+    "filter_kategorien": (
+        "SELECT id, name, anzeigeKategorie, noIndex, kategorieID, sort FROM filter_kategorien",
+        FilterKategorie
+    ),
+}
+
+# loaded once per process, every indexer in the run shares the same lookups
+cache = {}
+lock = threading.Lock()
+
+
+def text(value):
+    return value.decode() if isinstance(value, (bytes, bytearray)) else value
+
+
+def concat(*values):
+    # same NULL semantics as MySQL's CONCAT
+    if any(value is None for value in values):
+        return None
+    return "".join(str(text(value)) for value in values)
+
+
+def build_dimension(table, records):
+    _, row_type = dimension_queries[table]
+    return {int(record[0]): row_type(*(text(value) for value in record[1:])) for record in records}
+
+
+def get_dimension(table):
+    with lock:
+        if table not in cache:
+            cache[table] = build_dimension(table, fetch_all(dimension_queries[table][0]))
+        return cache[table]
+
+
+def put_dimension(table, records):
+    # for callers that read the table on their own, e.g. over another driver
+    with lock:
+        cache[table] = build_dimension(table, records)
+        return cache[table]
+
+
+def invalidate(table=None):
+    with lock:
+        if table is None:
+            cache.clear()
+        else:
+            cache.pop(table, None)
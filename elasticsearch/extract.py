@@ -0,0 +1,254 @@
+import os
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+from dotenv import load_dotenv
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+DB_HOST = os.environ.get("DB_HOST")
+DB_USER = os.environ.get("DB_USER")
+DB_PASS = os.environ.get("DB_PASS")
+DATABASE = os.environ.get("DB_DATABASE")
+
+# placeholder in the WHERE clause of a query that gets replaced by the key range
+RANGE = "{range}"
+
+# more ranges than workers, so one slow range does not hold up the others
+ranges_per_worker = 8
+# and no range spans more keys than this; ordered_ranges() keeps two per worker in flight, so this
+# bounds the rows held at once instead of a fixed share of the table
+max_range_keys = 20000
+
+# a pool is shared by every task asking for the same size, with the orchestrator running several of
+# them a query can find all connections out and waits up to this long for one to come back
+acquire_timeout = 600
+acquire_poll = 0.05
+
+# GROUP_CONCAT cuts its result at group_concat_max_len, 1024 bytes by default, which the review
+# columns of the items query pass for popular products
+session_query = "SET SESSION group_concat_max_len = 16777216"
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(size):
+    size = max(1, min(size, pooling.CNX_POOL_MAXSIZE))
+
+    with pools_lock:
+        if size not in pools:
+            pools[size] = pooling.MySQLConnectionPool(
+                pool_name="extract_{}".format(size),
+                pool_size=size,
+                host=DB_HOST,
+                user=DB_USER,
+                password=DB_PASS,
+                database=DATABASE
+            )
+        return pools[size]
+
+
+def set_session(connection):
+    session_cursor = connection.cursor()
+    session_cursor.execute(session_query)
+    session_cursor.close()
+
+
+def get_connection(pool):
+    # pool.get_connection() raises PoolError right away when the pool is exhausted; the session is
+    # set every time, the pool resets it whenever a connection goes back
+    deadline = time.time() + acquire_timeout
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except PoolError:
+            if time.time() >= deadline:
+                raise
+            time.sleep(acquire_poll)
+
+    try:
+        set_session(connection)
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def serial_query(sql_query):
+    return sql_query.replace(RANGE, "1 = 1")
+
+
+def range_query(sql_query, key_column):
+    return sql_query.replace(RANGE, "{} BETWEEN %s AND %s".format(key_column))
+
+
+def split_ranges(low, high, parts):
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def key_ranges(low, high, workers):
+    parts = max(workers * ranges_per_worker, -(-(high - low + 1) // max_range_keys))
+    return split_ranges(low, high, parts)
+
+
+def key_bounds(pool, key_column, key_table):
+    initial_db = get_connection(pool)
+
+    try:
+        initial_cursor = initial_db.cursor()
+        initial_cursor.execute("SELECT MIN({0}), MAX({0}) FROM {1}".format(key_column.split('.')[-1], key_table))
+        low, high = initial_cursor.fetchone()
+        initial_cursor.close()
+        return low, high
+    finally:
+        initial_db.close()
+
+
+def fetch_range(pool, sql_query, low, high):
+    initial_db = get_connection(pool)
+
+    try:
+        initial_cursor = initial_db.cursor(prepared=True)
+        initial_cursor.execute(sql_query, (low, high))
+        records = initial_cursor.fetchall()
+        initial_cursor.close()
+        return records
+    finally:
+        initial_db.close()
+
+
+def parallel_query(sql_query, key_column, key_table, workers=4, limit_count=None, order_key=None, reverse=False):
+    pool = get_pool(workers)
+
+    low, high = key_bounds(pool, key_column, key_table)
+    if low is None:
+        return
+
+    ranges = key_ranges(int(low), int(high), workers)
+    sql_query = range_query(sql_query, key_column)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if order_key is not None:
+            # every range comes back sorted by the query's ORDER BY, merge them into one sorted stream
+            futures = [executor.submit(fetch_range, pool, sql_query, start, end) for start, end in ranges]
+            records = heapq.merge(*(future.result() for future in futures), key=order_key, reverse=reverse)
+        else:
+            records = ordered_ranges(executor, partial(fetch_range, pool, sql_query), ranges, workers)
+
+        if limit_count is not None:
+            records = itertools.islice(records, limit_count)
+
+        for record in records:
+            yield record
+
+
+def ordered_ranges(executor, fetch, ranges, workers):
+    # keep at most two ranges per worker in flight and hand them out in key order
+    pending = deque()
+    ranges = iter(ranges)
+
+    for start, end in itertools.islice(ranges, workers * 2):
+        pending.append(executor.submit(fetch, start, end))
+
+    while pending:
+        records = pending.popleft().result()
+        for start, end in itertools.islice(ranges, 1):
+            pending.append(executor.submit(fetch, start, end))
+        for record in records:
+            yield record
+
+
+def merge_join(parents, children):
+    # parents and every child stream are sorted by the parent key in column 0
+    children = [iter(child) for child in children]
+    heads = [next(child, None) for child in children]
+    key = attached = None
+
+    for parent in parents:
+        if attached is not None and parent[0] == key:
+            # a parent row repeated by a join gets the same children, they were read for the first one
+            yield parent, attached
+            continue
+
+        key = parent[0]
+        attached = []
+        for position, child in enumerate(children):
+            head = heads[position]
+            while head is not None and head[0] < key:
+                head = next(child, None)
+            rows = []
+            while head is not None and head[0] == key:
+                rows.append(head)
+                head = next(child, None)
+            heads[position] = head
+            attached.append(rows)
+        yield parent, attached
+
+
+def fetch_merged_range(pool, parent_query, child_queries, low, high):
+    parents = fetch_range(pool, parent_query, low, high)
+    children = [fetch_range(pool, child_query, low, high) for child_query in child_queries]
+    return list(merge_join(parents, children))
+
+
+def merged_query(parent_query, key_column, key_table, child_queries, workers=4, limit_count=None):
+    # child_queries are (query, key column) pairs of one-to-many tables, each ordered by that key
+    pool = get_pool(workers)
+
+    low, high = key_bounds(pool, key_column, key_table)
+    if low is None:
+        return
+
+    ranges = key_ranges(int(low), int(high), workers)
+    parent_query = range_query(parent_query, key_column)
+    child_queries = [range_query(child_query, child_key_column) for child_query, child_key_column in child_queries]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        records = ordered_ranges(executor, partial(fetch_merged_range, pool, parent_query, child_queries), ranges, workers)
+
+        if limit_count is not None:
+            records = itertools.islice(records, limit_count)
+
+        for record in records:
+            yield record
+
+
+def ids_query(sql_query, key_column, count):
+    # takes the query with its {range} marker, after serial_query() there is nothing left to replace
+    # and the ids would not match the placeholders
+    if RANGE not in sql_query:
+        raise ValueError("query has no {} marker for the ids".format(RANGE))
+    return sql_query.replace(RANGE, "{} IN ({})".format(key_column, ", ".join(["%s"] * count)))
+
+
+def fetch_all(sql_query, params=()):
+    initial_db = get_connection(get_pool(1))
+
+    try:
+        initial_cursor = initial_db.cursor(prepared=True)
+        initial_cursor.execute(sql_query, params)
+        records = initial_cursor.fetchall()
+        initial_cursor.close()
+        return records
+    finally:
+        initial_db.close()
+
+
+def fetch_ids(sql_query, key_column, ids, batch_size=1000):
+    ids = sorted(ids)
+
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        for record in fetch_all(ids_query(sql_query, key_column, len(batch)), batch):
+            yield record
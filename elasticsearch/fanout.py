@@ -0,0 +1,215 @@
+import os
+import queue
+import threading
+import time
+
+from elasticsearch7 import Elasticsearch
+from dotenv import load_dotenv
+
+from alias import swap_alias
+from delta import current_mark, keyed_actions, save_mark
+from extract import parallel_query
+from generations import expired_generations, new_generation
+from indexers import load_script
+from lifecycle import finish_load
+from loader import max_connections, parallel_bulk
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+limit_count = None
+workers = 4
+batch_size = 2000
+queue_depth = 8
+# how long a put waits before checking that the builder still reads its queue
+put_timeout = 5.0
+
+# the items columns (0-34) followed by what products and prices need on top of them
+fanout_query = """
+SELECT
+    p.id, p.PNAME, p.PURL, p.DATENBLATT, p.DATENBLATTDETAILS, p.IMG, p.MAN, p.EAN, p.CONTENT, p.TESTCONTENT, p.SCORE, p.TESTS, p.TESTPRO, p.TESTCONTRA, p.TESTSIEGER,
+    p.PREISSIEGER, p.MEINUNGENSCORE, p.MEINUNGEN, p.meinungenPunkte, p.AMAZONMEINUNGEN, p.serienZusatz, TRIM(LEADING '{' from (TRIM(TRAILING '}' FROM 'p.energieEffizienzKlasse' ))) AS 'energieEffizienzKlasse', p.noindex noIndex, p.noIndex2,
+    pa.anzAngebote, pa.preis, pa.sortPos,
+    k.noIndex noIndexKategorie, k.kategorieURL,
+    pb.pfad bildPfad, pb.breite, pb.hoehe,
+    GROUP_CONCAT(DISTINCT CONCAT(mas.star, '-', mas.anzahl) SEPARATOR '|') starsAmazon,
+    GROUP_CONCAT(DISTINCT CONCAT(mos.star, '-', mos.anzahl) SEPARATOR '|') starsOtto,
+    GROUP_CONCAT(DISTINCT CONCAT(m.id, '-', m.meinungstern) SEPARATOR '|') starsTBDE,
+    pbs.pfad bildPfadKlein, pa.punkte, p.kategorieID, p.herstellerID, p.gesperrt, h.gesperrt herstellerGesperrt, pa.produktID
+FROM
+    pname2pid_mapping p
+LEFT JOIN
+    pname2pid_angebote pa ON(pa.produktID = p.id)
+LEFT JOIN
+    kategorien k ON(k.id = p.kategorieID)
+LEFT JOIN
+    hersteller h ON(h.id = p.herstellerID)
+LEFT JOIN
+    tbmeinungen m ON (m.produktID = p.id AND m.meinungstatus = 0)
+LEFT JOIN
+    meinungen_amazon_stars mas ON (mas.produktID = p.id)
+LEFT JOIN
+    meinungen_otto_stars mos ON (mos.produktID = p.id)
+LEFT JOIN
+    produktbilder pb ON(pb.produktID = p.ID AND pb.pos = 1 AND pb.groesse = 'L')
+LEFT JOIN
+    produktbilder pbs ON(pbs.produktID = p.ID AND pbs.pos = 1 AND pbs.groesse = 'S')
+WHERE
+    {range}
+GROUP BY
+    p.id
+"""
+
+
+def item_record(record):
+    # WHERE p.gesperrt = 0 AND h.gesperrt = 0 of getAllItems.py
+    if record[39] != 0 or record[40] != 0:
+        return None
+    return record[:35]
+
+
+def product_record(record):
+    # INNER JOINs on the small image and the offer row of product.py
+    if record[35] is None or record[41] is None:
+        return None
+    return (record[0], record[1], record[2], record[35], record[11], record[10], record[36], record[37], record[38])
+
+
+def price_record(record):
+    if record[41] is None:
+        return None
+    return (record[41], record[25])
+
+
+# alias, script, projection from the shared row to the script's own record layout, document generator
+builders = [
+    ("items", "getAllItems", item_record, "generate_items"),
+    ("products", "product", product_record, "generate_products"),
+    ("prices", "price", price_record, "generate_prices"),
+]
+
+
+def connect_elasticsearch():
+    _es = None
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections * len(builders))
+    if _es.ping():
+        print('Connect to Elasticsearch')
+    else:
+        print('it could not connect!')
+    return _es
+
+
+class ExtractionFailed(Exception):
+    pass
+
+
+def drain(records_queue):
+    while True:
+        batch = records_queue.get()
+        if batch is None:
+            return
+        if batch is ExtractionFailed:
+            raise ExtractionFailed("extraction stopped before the last row")
+        for record in batch:
+            yield record
+
+
+def build(es_object, alias, script, generator_name, records_queue, results):
+    start_time = time.time()
+
+    try:
+        module = load_script(script)
+        ind_name = new_generation(alias)
+        module.create_index(es_object=es_object, index_name=ind_name)
+
+        documents = getattr(module, generator_name)(drain(records_queue))
+        imported, _ = parallel_bulk(es_object, keyed_actions(documents), index=ind_name, alias=alias)
+        finish_load(es_object, ind_name, alias=alias)
+
+        swap_alias(es_object, alias, ind_name, remove_indices=expired_generations(es_object, alias))
+
+        results[alias] = (imported, time.time() - start_time)
+    except Exception as ex:
+        print("{} failed: {}".format(alias, ex))
+        results[alias] = None
+        # keep reading so the extraction is not blocked by a dead builder
+        try:
+            for _ in drain(records_queue):
+                pass
+        except ExtractionFailed:
+            pass
+
+
+def feed(records_queue, thread, item):
+    # False once the builder thread is gone, nothing would ever take the item off a full queue
+    while True:
+        try:
+            records_queue.put(item, timeout=put_timeout)
+            return True
+        except queue.Full:
+            if not thread.is_alive():
+                return False
+
+
+def main():
+    print("=========== Start Fanout ===========")
+
+    start_time = time.time()
+
+    es_object = connect_elasticsearch()
+    next_mark = current_mark()
+
+    results = {}
+    queues = []
+    threads = []
+    for alias, script, project, generator_name in builders:
+        records_queue = queue.Queue(maxsize=queue_depth)
+        thread = threading.Thread(target=build, args=(es_object, alias, script, generator_name, records_queue, results))
+        thread.start()
+        queues.append((project, records_queue, thread))
+        threads.append(thread)
+
+    count = 0
+    batch = []
+    end_marker = ExtractionFailed
+    try:
+        for record in parallel_query(fanout_query, key_column="p.id", key_table="pname2pid_mapping", workers=workers, limit_count=limit_count):
+            batch.append(record)
+            count += 1
+            if len(batch) >= batch_size:
+                queues = [(project, records_queue, thread) for project, records_queue, thread in queues
+                          if feed(records_queue, thread, [row for row in map(project, batch) if row is not None])]
+                batch = []
+                if not queues:
+                    print("--- every builder stopped, extraction aborted ---")
+                    break
+        else:
+            queues = [(project, records_queue, thread) for project, records_queue, thread in queues
+                      if feed(records_queue, thread, [row for row in map(project, batch) if row is not None])]
+            end_marker = None
+    finally:
+        # on a failed extraction the builders abort instead of swapping a half-filled index
+        for _, records_queue, thread in queues:
+            feed(records_queue, thread, end_marker)
+        for thread in threads:
+            thread.join()
+
+    print("--- Read: {} rows ---".format(count))
+    for alias, script, _, _ in builders:
+        if results.get(alias) is None:
+            print("--- {}: failed, alias not swapped ---".format(alias))
+            continue
+        imported, seconds = results[alias]
+        print("--- {}: {} records in {:10.1f} seconds ---".format(alias, imported, seconds))
+
+    if results.get("items") is not None:
+        save_mark("items", next_mark)
+    if results.get("prices") is not None:
+        save_mark("prices", next_mark)
+
+    print("--- Total: {:10.1f} seconds ---".format(time.time() - start_time))
+    print("============ End Fanout ===========")
+
+
+if __name__ == '__main__':
+    main()
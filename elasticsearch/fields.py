@@ -0,0 +1,51 @@
+# field specs are (column, target, kind) or (column, target, kind, default); kind is one of
+# the conversions below or a function that gets the column value
+conversions = {
+    "id": "int({0})",
+    "raw": "{0}",
+    "str": "{0} if {0} else {default}",
+    "bytes": "{0}.decode() if {0} else {default}",
+    "int": "int({0}) if {0} else {default}",
+    "float": "float({0}) if {0} else {default}",
+}
+
+defaults = {
+    "str": "",
+    "bytes": "",
+    "int": 0,
+    "float": 0,
+}
+
+
+def compile_fields(fields, name="to_document"):
+    # generates one function per spec: the record is unpacked once into locals and the document
+    # is a single dict display, instead of indexing the record and branching per field in a loop
+    width = max(field[0] for field in fields) + 1
+    namespace = {}
+
+    lines = [
+        "def {}(record):".format(name),
+        "    {}, = record[:{}]".format(", ".join("c{}".format(column) for column in range(width)), width),
+        "    return {",
+    ]
+
+    for position, field in enumerate(fields):
+        column, target, kind = field[:3]
+        value = "c{}".format(column)
+
+        if callable(kind):
+            namespace["convert_{}".format(position)] = kind
+            expression = "convert_{}({})".format(position, value)
+        else:
+            default = field[3] if len(field) > 3 else defaults.get(kind)
+            expression = conversions[kind].format(value, default=repr(default))
+
+        lines.append("        {!r}: {},".format(target, expression))
+
+    lines.append("    }")
+    source = "\n".join(lines) + "\n"
+
+    exec(compile(source, "<fields {}>".format(name), "exec"), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
@@ -0,0 +1,136 @@
+import sys
+import time
+
+from elasticsearch7 import Elasticsearch
+
+from alias import alias_indices, live_key, swap_aliases
+
+# every load builds a new <alias>-<timestamp> index; the newest ones are kept after the swap, so a
+# bad load can be undone by pointing the alias back at the one before
+default_retained = 2
+retained = {
+    "items": 3,
+    "products": 3,
+    "prices": 3,
+}
+
+# indices of the old two-slot scheme, they stay generations of their alias until they expire
+legacy_prefixes = ("primary_", "secondary_")
+
+
+def connect_elasticsearch():
+    _es = None
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500)
+    if _es.ping():
+        print('Connect to Elasticsearch')
+    else:
+        print('it could not connect!')
+    return _es
+
+
+def generation_pattern(alias):
+    # "hersteller-*" does not match herstellerfilters-..., the alias names share prefixes
+    return "{}-*".format(alias)
+
+
+def new_generation(alias):
+    return "{}-{}".format(alias, time.strftime("%Y%m%d%H%M%S"))
+
+
+def generation_patterns(alias):
+    # only wildcards are asked for, a missing concrete name would fail the whole request
+    return [prefix + alias + "*" for prefix in legacy_prefixes] + [generation_pattern(alias)]
+
+
+def generation_names(alias, indices):
+    # the _cat/indices entries that are generations of the alias, oldest first
+    legacy = [prefix + alias for prefix in legacy_prefixes]
+    indices = [entry for entry in indices if entry["index"] in legacy or entry["index"].startswith(alias + "-")]
+    return [entry["index"] for entry in sorted(indices, key=lambda entry: (int(entry["creation.date"]), entry["index"]))]
+
+
+def live_names(response):
+    # the indices of a get_mapping response that alias.mark_live() marked
+    return {index for index, entry in response.items() if entry.get("mappings", {}).get("_meta", {}).get(live_key)}
+
+
+def split_generations(names, live):
+    # names oldest first -> (generations, abandoned, pending). Indices from before the first marked
+    # one are from before the marking and count as generations. After it, an unmarked index older
+    # than the newest marked one was never swapped in (a failed or discarded load), a newer one is
+    # still on its way to its swap
+    marked = [position for position, name in enumerate(names) if name in live]
+    if not marked:
+        return names, [], []
+
+    first, last = marked[0], marked[-1]
+    kept = names[:first] + [name for name in names[first:last + 1] if name in live]
+    abandoned = [name for name in names[first:last] if name not in live]
+    return kept, abandoned, names[last + 1:]
+
+
+def generation_state(es_object, alias):
+    # the generation names oldest first and the marked ones among them
+    patterns = ",".join(generation_patterns(alias))
+    indices = es_object.cat.indices(index=patterns, h="index,creation.date", format="json")
+    mappings = es_object.indices.get_mapping(index=patterns, filter_path="*.mappings._meta." + live_key)
+    return generation_names(alias, indices), live_names(mappings)
+
+
+def generations(es_object, alias):
+    return split_generations(*generation_state(es_object, alias))[0]
+
+
+def expired(alias, names):
+    # everything but the newest retained ones, call it once the new generation exists
+    keep = retained.get(alias, default_retained)
+    return names[:-keep]
+
+
+def removable(alias, names, live):
+    # the expired generations and the abandoned loads. The scripts ask before their swap, so their new
+    # generation is the newest pending one and counts towards the retained ones; an older pending one
+    # is a failed load, it is left alone and abandoned once the new one is marked
+    kept, abandoned, pending = split_generations(names, live)
+    return expired(alias, kept + pending[-1:]) + abandoned
+
+
+def expired_generations(es_object, alias):
+    return removable(alias, *generation_state(es_object, alias))
+
+
+def rollback(es_object, alias, index=None):
+    # points the alias at the generation before the live one, or at the given one, in one _aliases call;
+    # nothing is deleted, rolling forward again is a rollback to the newer index
+    available = generations(es_object, alias)
+    live = alias_indices(es_object, [alias])[alias]
+
+    if index is None:
+        positions = [available.index(name) for name in live if name in available]
+        if not positions or min(positions) == 0:
+            print("No generation of {} before {}".format(alias, ", ".join(live) or "-"))
+            return None
+        index = available[min(positions) - 1]
+    elif index not in available:
+        print("{} is not a generation of {}: {}".format(index, alias, ", ".join(available)))
+        return None
+
+    return swap_aliases(es_object, {alias: index})
+
+
+def show(es_object, alias):
+    live = alias_indices(es_object, [alias])[alias]
+    for index in generations(es_object, alias):
+        print("{} {}".format("*" if index in live else " ", index))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ("list", "rollback"):
+        print("usage: generations.py list <alias> | rollback <alias> [index]")
+        sys.exit(1)
+
+    es_object = connect_elasticsearch()
+    if sys.argv[1] == "list":
+        show(es_object, sys.argv[2])
+    elif rollback(es_object, sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None) is None:
+        sys.exit(1)
@@ -1,10 +1,22 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
+import sys
 import time
-
-from alias import add_alias
+from functools import partial
+
+from alias import swap_alias
+from delta import changed_ids, current_mark, delta_actions, keyed_actions, load_mark, save_mark
+from dimensions import text
+from extract import fetch_ids, merged_query, parallel_query, serial_query, set_session
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections, parallel_bulk
+from pipeline import run_pipeline
+from snapshot import cached_query
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,25 +27,12 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_items"
-old_index = "secondary_items"
-
-
-def query():
-    initial_db = None
-    initial_cursor = None
-
-    try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
+stream_mode = True
+merge_children = True
+batch_size = 2000
+workers = 4
 
-        sql_query = """
+items_query = """
 SELECT
     p.id, p.PNAME, p.PURL, p.DATENBLATT, p.DATENBLATTDETAILS, p.IMG, p.MAN, p.EAN, p.CONTENT, p.TESTCONTENT, p.SCORE, p.TESTS, p.TESTPRO, p.TESTCONTRA, p.TESTSIEGER,
     p.PREISSIEGER, p.MEINUNGENSCORE, p.MEINUNGEN, p.meinungenPunkte, p.AMAZONMEINUNGEN, p.serienZusatz, TRIM(LEADING '{' from (TRIM(TRAILING '}' FROM 'p.energieEffizienzKlasse' ))) AS 'energieEffizienzKlasse', p.noindex noIndex, p.noIndex2,
@@ -60,12 +59,182 @@ LEFT JOIN
 LEFT JOIN
     produktbilder pb ON(pb.produktID = p.ID AND pb.pos = 1 AND pb.groesse = 'L')
 WHERE
+    {range} AND
     p.gesperrt = 0 AND
     h.gesperrt = 0
 GROUP BY
     p.id
-        """
+"""
+
+# items_query without the review tables, they are read as separate streams and merged in Python
+items_parent_query = """
+SELECT
+    p.id, p.PNAME, p.PURL, p.DATENBLATT, p.DATENBLATTDETAILS, p.IMG, p.MAN, p.EAN, p.CONTENT, p.TESTCONTENT, p.SCORE, p.TESTS, p.TESTPRO, p.TESTCONTRA, p.TESTSIEGER,
+    p.PREISSIEGER, p.MEINUNGENSCORE, p.MEINUNGEN, p.meinungenPunkte, p.AMAZONMEINUNGEN, p.serienZusatz, TRIM(LEADING '{' from (TRIM(TRAILING '}' FROM 'p.energieEffizienzKlasse' ))) AS 'energieEffizienzKlasse', p.noindex noIndex, p.noIndex2,
+    pa.anzAngebote, pa.preis, pa.sortPos,
+    k.noIndex noIndexKategorie, k.kategorieURL,
+    pb.pfad bildPfad, pb.breite, pb.hoehe
+FROM
+    pname2pid_mapping p
+LEFT JOIN
+    pname2pid_angebote pa ON(pa.produktID = p.id)
+LEFT JOIN
+    kategorien k ON(k.id = p.kategorieID)
+LEFT JOIN
+    hersteller h ON(h.id = p.herstellerID)
+LEFT JOIN
+    produktbilder pb ON(pb.produktID = p.ID AND pb.pos = 1 AND pb.groesse = 'L')
+WHERE
+    {range} AND
+    p.gesperrt = 0 AND
+    h.gesperrt = 0
+ORDER BY
+    p.id
+"""
+
+# starsAmazon, starsOtto and starsTBDE, each as (produktID, first, second) ordered by produktID
+items_child_queries = [
+    ("""
+SELECT produktID, star, anzahl FROM meinungen_amazon_stars WHERE {range} ORDER BY produktID
+""", "produktID"),
+    ("""
+SELECT produktID, star, anzahl FROM meinungen_otto_stars WHERE {range} ORDER BY produktID
+""", "produktID"),
+    ("""
+SELECT produktID, id, meinungstern FROM tbmeinungen WHERE {range} AND meinungstatus = 0 ORDER BY produktID
+""", "produktID"),
+]
+
+# source tables of the items records, a snapshot is reused while none of them was written to
+items_tables = [
+    "pname2pid_mapping", "pname2pid_angebote", "kategorien", "hersteller", "produktbilder",
+    "tbmeinungen", "meinungen_amazon_stars", "meinungen_otto_stars",
+]
+
+# products whose own row, offer row or manufacturer changed since the last run; kategorien and the
+# review tables have no aktualisiert column to compare with, their changes reach the items through
+# cdc or the next full load
+items_changed_query = """
+SELECT id FROM pname2pid_mapping WHERE aktualisiert > %s
+UNION
+SELECT produktID FROM pname2pid_angebote WHERE aktualisiert > %s
+UNION
+SELECT p.id FROM pname2pid_mapping p INNER JOIN hersteller h ON(h.id = p.herstellerID) WHERE h.aktualisiert > %s
+"""
+
+
+def histogram(pairs):
+    # review counts for 1 to 5 stars
+    counts = [0] * 5
+    for star, count in pairs:
+        if star is None or count is None:
+            continue
+        star = int(round(float(star)))
+        if 1 <= star <= 5:
+            counts[star - 1] += int(count)
+    return tuple(counts)
+
+
+def concat_pairs(value):
+    # "a-b|a-b|..." of GROUP_CONCAT; a string cut at group_concat_max_len ends in a partial entry
+    # like "100113-", that one is skipped instead of failing the whole document
+    pairs = []
+    for entry in text(value).split('|'):
+        first, _, second = entry.partition('-')
+        try:
+            pairs.append((float(first), float(second)))
+        except ValueError:
+            continue
+    return pairs
+
+
+def star_counts(value, reviews=False):
+    # value is a histogram from merged_items() or a GROUP_CONCAT string from the single query;
+    # starsAmazon/starsOtto hold "star-anzahl" pairs, starsTBDE holds "id-meinungstern" per review
+    if value is None or isinstance(value, tuple):
+        return value or (0, 0, 0, 0, 0)
+
+    pairs = concat_pairs(value)
+    if reviews:
+        return histogram((star, 1) for _, star in pairs)
+    return histogram(pairs)
+
+
+def stars(counts):
+    total = sum(counts)
+    return {
+        "count": total,
+        "mean": round(sum(star * count for star, count in enumerate(counts, 1)) / total, 2) if total else 0,
+        "star1": counts[0],
+        "star2": counts[1],
+        "star3": counts[2],
+        "star4": counts[3],
+        "star5": counts[4],
+    }
+
+
+def star_field(value):
+    return stars(star_counts(value))
+
+
+def review_star_field(value):
+    return stars(star_counts(value, reviews=True))
+
+
+def merged_items():
+    last_id = None
+
+    for parent, (amazon, otto, meinungen) in merged_query(
+        items_parent_query,
+        key_column="p.id",
+        key_table="pname2pid_mapping",
+        child_queries=items_child_queries,
+        workers=workers,
+        limit_count=limit_count
+    ):
+        # duplicate offer or image rows used to be collapsed by the GROUP BY
+        if parent[0] == last_id:
+            continue
+        last_id = parent[0]
+
+        # the DISTINCT of the old GROUP_CONCAT
+        amazon, otto, meinungen = dict.fromkeys(amazon), dict.fromkeys(otto), dict.fromkeys(meinungen)
+
+        yield tuple(parent) + (
+            histogram((star, anzahl) for _, star, anzahl in amazon),
+            histogram((star, anzahl) for _, star, anzahl in otto),
+            histogram((meinungstern, 1) for _, _, meinungstern in meinungen),
+        )
+
+
+def query():
+    initial_db = None
+    initial_cursor = None
+
+    try:
+        if merge_children:
+            return list(merged_items())
+
+        if workers > 1:
+            return list(parallel_query(
+                items_query,
+                key_column="p.id",
+                key_table="pname2pid_mapping",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
+        initial_db = mysql.connector.connect(
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASS,
+            database=DATABASE
+        )
+        set_session(initial_db)
+
+        initial_cursor = initial_db.cursor(prepared=True)
 
+        sql_query = serial_query(items_query)
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -77,7 +246,7 @@ GROUP BY
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -85,9 +254,71 @@ GROUP BY
             initial_db.close()
 
 
+def stream_query():
+    initial_db = None
+    initial_cursor = None
+
+    try:
+        if merge_children:
+            yield from merged_items()
+            return
+
+        if workers > 1:
+            yield from parallel_query(
+                items_query,
+                key_column="p.id",
+                key_table="pname2pid_mapping",
+                workers=workers,
+                limit_count=limit_count
+            )
+            return
+
+        initial_db = mysql.connector.connect(
+            host=DB_HOST,
+            user=DB_USER,
+            password=DB_PASS,
+            database=DATABASE,
+            consume_results=True
+        )
+
+        # the server must not drop us while the bulk loader is still busy with the previous batch
+        session_cursor = initial_db.cursor()
+        session_cursor.execute("SET SESSION net_write_timeout = 3600")
+        session_cursor.close()
+        set_session(initial_db)
+
+        initial_cursor = initial_db.cursor(prepared=True)
+
+        sql_query = serial_query(items_query)
+
+        if limit_count is not None:
+            sql_query += " LIMIT %s"
+            initial_cursor.execute(sql_query, (limit_count,))
+        else:
+            initial_cursor.execute(sql_query)
+
+        while True:
+            records = initial_cursor.fetchmany(batch_size)
+            if not records:
+                break
+            for record in records:
+                yield record
+
+    except mysql.connector.Error as e:
+        # a half-read stream must fail the run instead of swapping in a partial index
+        print("Failed to query table in MySQL: {}".format(e))
+        raise
+
+    finally:
+        if initial_db and initial_db.is_connected():
+            if initial_cursor:
+                initial_cursor.close()
+            initial_db.close()
+
+
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -98,129 +329,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "PNAME": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "PURL": {
-                    "type": "text",
-                },
-                "DATENBLATT": {
-                    "type": "text",
-                },
-                "DATENBLATTDETAILS": {
-                    "type": "text",
-                },
-                "IMG": {
-                    "type": "text",
-                },
-                "MAN": {
-                    "type": "text",
-                },
-                "EAN": {
-                    "type": "text",
-                },
-                "CONTENT": {
-                    "type": "text",
-                },
-                "TESTCONTENT": {
-                    "type": "text",
-                },
-                "SCORE": {
-                    "type": "long",
-                },
-                "TESTS": {
-                    "type": "long",
-                },
-                "TESTPRO": {
-                    "type": "text",
-                },
-                "TESTCONTRA": {
-                    "type": "text",
-                },
-                "TESTSIEGER": {
-                    "type": "long",
-                },
-                "PREISSIEGER": {
-                    "type": "long",
-                },
-                "MEINUNGENSCORE": {
-                    "type": "text",
-                },
-                "MEINUNGEN": {
-                    "type": "long",
-                },
-                "meinungenPunkte": {
-                    "type": "double",
-                },
-                "AMAZONMEINUNGEN": {
-                    "type": "long",
-                },
-                "serienZusatz": {
-                    "type": "text",
-                },
-                "energieEffizienzKlasse": {
-                    "type": "text",
-                },
-                "noIndex": {
-                    "type": "short",
-                },
-                "noIndex2": {
-                    "type": "short",
-                },
-                "anzAngebote": {
-                    "type": "long",
-                },
-                "preis": {
-                    "type": "long",
-                },
-                "sortPos": {
-                    "type": "long",
-                },
-                "noIndexKategorie": {
-                    "type": "short",
-                },
-                "kategorieURL": {
-                    "type": "text",
-                },
-                "bildPfad": {
-                    "type": "text",
-                },
-                "breite": {
-                    "type": "long",
-                },
-                "hoehe": {
-                    "type": "long",
-                },
-                "starsAmazon": {
-                    "type": "text",
-                },
-                "starsOtto": {
-                    "type": "text",
-                },
-                "starsTBDE": {
-                    "type": "text",
-                },
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'items')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'items'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -240,82 +353,143 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start items ===========")
+item_fields = [
+    (0, "id", "id"),
+    (1, "PNAME", "str"),
+    (2, "PURL", "str"),
+    (3, "DATENBLATT", "str"),
+    (4, "DATENBLATTDETAILS", "str"),
+    (5, "IMG", "str"),
+    (6, "MAN", "str"),
+    (7, "EAN", "str"),
+    (8, "CONTENT", "str"),
+    (9, "TESTCONTENT", "str"),
+    (10, "SCORE", "int"),
+    (11, "TESTS", "int"),
+    (12, "TESTPRO", "str"),
+    (13, "TESTCONTRA", "str"),
+    (14, "TESTSIEGER", "int"),
+    (15, "PREISSIEGER", "int"),
+    (16, "MEINUNGENSCORE", "str"),
+    (17, "MEINUNGEN", "int"),
+    (18, "meinungenPunkte", "float"),
+    (19, "AMAZONMEINUNGEN", "int"),
+    (20, "serienZusatz", "str"),
+    (21, "energieEffizienzKlasse", "str"),
+    (22, "noIndex", "int"),
+    (23, "noIndex2", "int"),
+    (24, "anzAngebote", "int"),
+    (25, "preis", "int"),
+    (26, "sortPos", "int"),
+    (27, "noIndexKategorie", "int"),
+    (28, "kategorieURL", "str"),
+    (29, "bildPfad", "str"),
+    (30, "breite", "int"),
+    (31, "hoehe", "int"),
+    (32, "starsAmazon", star_field),
+    (33, "starsOtto", star_field),
+    (34, "starsTBDE", review_star_field),
+]
+
+to_item = compile_fields(item_fields, "to_item")
+
+
+def generate_items(records):
+    for record in records:
+        yield to_item(record)
+
+
+def delta_main(mark, es_object=None):
+    """Update the items changed since mark, found by items_changed_query.
+
+    Only the aktualisiert times of pname2pid_mapping, pname2pid_angebote and hersteller are
+    compared; an edited category or review (tbmeinungen, meinungen_amazon_stars,
+    meinungen_otto_stars) does not show up here until cdc or a full load picks it up.
+    """
+    print("=========== Start items delta ===========")
 
     start_time = time.time()
 
-    es_object = connect_elasticsearch()
+    es_object = es_object or connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+    try:
+        next_mark = current_mark()
+        changed = changed_ids(items_changed_query, mark)
+        query_time = time.time()
+        print("--- Changed: {:10.1f} seconds ---".format(query_time - start_time))
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
+        records = fetch_ids(items_query, "p.id", changed)
+        imported, _ = parallel_bulk(es_object, delta_actions('items', changed, generate_items(records)), alias='items', ignore_status=(404,))
+    except mysql.connector.Error as e:
+        # the mark stays where it is, and the caller (cron, orchestrator, daemon) sees the failed run
+        print("Failed to query table in MySQL: {}".format(e))
+        raise
 
-    items = []
-    for record in records:
-        row = {
-            "id": int(record[0]),
-            "PNAME": record[1] if record[1] else "",
-            "PURL": record[2] if record[2] else "",
-            "DATENBLATT": record[3] if record[3] else "",
-            "DATENBLATTDETAILS": record[4] if record[4] else "",
-            "IMG": record[5] if record[5] else "",
-            "MAN": record[6] if record[6] else "",
-            "EAN": record[7] if record[7] else "",
-            "CONTENT": record[8] if record[8] else "",
-            "TESTCONTENT": record[9] if record[9] else "",
-            "SCORE": int(record[10]) if record[10] else 0,
-            "TESTS": int(record[11]) if record[11] else 0,
-            "TESTPRO": record[12] if record[12] else "",
-            "TESTCONTRA": record[13] if record[13] else "",
-            "TESTSIEGER": int(record[14]) if record[14] else 0,
-            "PREISSIEGER": int(record[15]) if record[15] else 0,
-            "MEINUNGENSCORE": record[16] if record[16] else "",
-            "MEINUNGEN": int(record[17]) if record[17] else 0,
-            "meinungenPunkte": float(record[18]) if record[18] else 0,
-            "AMAZONMEINUNGEN": int(record[19]) if record[19] else 0,
-            "serienZusatz": record[20] if record[20] else "",
-            "energieEffizienzKlasse": record[21] if record[21] else "",
-            "noIndex": int(record[22]) if record[22] else 0,
-            "noIndex2": int(record[23]) if record[23] else 0,
-            "anzAngebote": int(record[24]) if record[24] else 0,
-            "preis": int(record[25]) if record[25] else 0,
-            "sortPos": int(record[26]) if record[26] else 0,
-            "noIndexKategorie": int(record[27]) if record[27] else 0,
-            "kategorieURL": record[28] if record[28] else "",
-            "bildPfad": record[29] if record[29] else "",
-            "breite": int(record[30]) if record[30] else 0,
-            "hoehe": int(record[31]) if record[31] else 0,
-            "starsAmazon": record[32] if record[32] else "",
-            "starsOtto": record[33] if record[33] else "",
-            "starsTBDE": record[34] if record[34] else "",
-        }
-
-        items.append(row)
-
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, items, index=ind_name)
+    save_mark('items', next_mark)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(items))
-
-    add_alias(option='items', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("--- Delta: {:10.1f} seconds ---".format(elastic_time - query_time))
+    print("Changed Records:", len(changed))
+    print("Updated Records:", imported)
+
+    print("============ End items delta ===========")
+
+
+def snapshot_records(fetch):
+    key_parts = [items_query, items_parent_query, merge_children, limit_count]
+    key_parts += [child_query for child_query, _ in items_child_queries]
+    return cached_query('items', key_parts, items_tables, fetch)
+
+
+def main(delta=False, snapshot=False, es_object=None):
+    mark = load_mark('items') if delta else None
+    if mark is not None:
+        return delta_main(mark, es_object=es_object)
+    if delta:
+        print("No high-water mark for items yet, running a full rebuild")
+
+    print("=========== Start items ===========")
+
+    start_time = time.time()
+
+    es_object = es_object or connect_elasticsearch()
+    next_mark = current_mark()
+
+    ind_name = new_generation('items')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    if stream_mode:
+        # query, transform and bulk run on their own threads joined by bounded queues, each stage
+        # prints how long it was busy
+        extract = partial(snapshot_records, stream_query) if snapshot else stream_query
+        imported, _ = run_pipeline(es_object, extract, generate_items, index=ind_name, alias='items', keyed=True)
+        elastic_time = time.time()
+        print("Imported Records:", imported)
+    else:
+        records = snapshot_records(query) if snapshot else query()
+        query_time = time.time()
+        delta_query = query_time - start_time
+        print("--- Query: {:10.1f} seconds ---".format(delta_query))
+
+        items = [to_item(record) for record in records]
+
+        json_time = time.time()
+        delta_json = json_time - query_time
+        print("--- Json: {:10.1f} seconds ---".format(delta_json))
+
+        parallel_bulk(es_object, keyed_actions(items), index=ind_name, alias='items')
+        elastic_time = time.time()
+        delta_elastic = elastic_time - json_time
+        print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
+        print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
+        print("Imported Records:", len(items))
+
+    finish_load(es_object, ind_name, alias='items')
+    # the mark moves with the alias, under orchestrator --atomic only if the swaps are committed
+    swap_alias(
+        es_object, 'items', ind_name,
+        remove_indices=expired_generations(es_object, 'items'),
+        after_swap=partial(save_mark, 'items', next_mark)
+    )
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -324,4 +498,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(delta='--delta' in sys.argv, snapshot='--snapshot' in sys.argv)
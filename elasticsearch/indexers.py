@@ -0,0 +1,16 @@
+import os
+import sys
+import importlib.util
+
+
+def load_script(name):
+    # keyword.py shadows the standard library module of the same name, so scripts are loaded by path
+    module_name = "indexer_{}".format(name)
+
+    if module_name not in sys.modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "{}.py".format(name))
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
@@ -0,0 +1,27 @@
+# index sort per alias, in the order the listings sort their first page; with sorted segments a
+# top-N query on the same sort stops collecting per segment once it has enough hits
+index_sorts = {
+    "items": [("SCORE", "desc"), ("TESTS", "desc")],
+    "products": [("points", "desc"), ("score", "desc"), ("test", "desc")],
+    "keywords": [("anzahl", "desc")],
+    "filters": [("anzahl", "desc")],
+    "herstellerfilters": [("anzahl", "desc")],
+    "filterherstellers": [("anzahl", "desc")],
+    "filterkombis": [("anzahl", "desc")],
+    "hersteller": [("anzahl", "desc")],
+    "testreihes": [("anzahl", "desc")],
+}
+
+
+def sort_settings(alias):
+    # the "index" part of the settings; an index sort can only be set when the index is created and
+    # the fields must be in the mapping by then
+    sort = index_sorts.get(alias)
+    if not sort:
+        return {}
+
+    return {
+        "sort.field": [field for field, _ in sort],
+        "sort.order": [order for _, order in sort],
+        "sort.missing": ["_last" for _ in sort],
+    }
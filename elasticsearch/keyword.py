@@ -1,10 +1,18 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import concat, get_dimension, text
+from extract import parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -18,8 +26,18 @@ TYPESENSE_HOST = os.environ.get("TYPESENSE_HOST")
 TYPESENSE_KEY = os.environ.get("TYPESENSE_KEY")
 
 limit_count = None
-new_index = "primary_keywords"
-old_index = "secondary_keywords"
+workers = 4
+
+keywords_query = """
+            SELECT
+                fn.id, fn.title, fn.anzeige, fn.anzeigeKategorie, fn.filterURL, fn.url, fn.fkid, fn.anzahl, fn.sort
+            FROM
+                filter_namen fn
+            WHERE
+                {range}
+            ORDER BY
+                fn.anzahl DESC
+        """
 
 
 def query():
@@ -27,6 +45,15 @@ def query():
     initial_cursor = None
 
     try:
+        if workers > 1:
+            return list(parallel_query(
+                keywords_query,
+                key_column="fn.id",
+                key_table="filter_namen",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
         initial_db = mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
@@ -36,23 +63,7 @@ def query():
 
         initial_cursor = initial_db.cursor(prepared=True)
 
-        sql_query = """
-            SELECT
-                IF(STRCMP(fn.title, ''), fn.title, CONCAT(k.kategorieName, ' ', IF(fn.anzeigeKategorie OR fk.anzeigeKategorie, CONCAT(fk.name, ': '), ''), fn.anzeige)) title,
-                CONCAT('/', k.kategorieURL, '/', IFNULL(fn.filterURL, fn.url)) url
-            FROM
-                filter_namen fn
-            LEFT JOIN
-                filter_kategorien fk ON(fk.id = fn.fkid)
-            LEFT JOIN
-                kategorien k ON(fk.kategorieID = k.id)
-            ORDER BY
-                fn.anzahl DESC,
-                IF(fk.sort <> 0, fk.sort, 999) ASC,
-                fk.name ASC,
-                IF(fn.sort <> 0, fn.sort, 999) ASC,
-                fn.anzeige ASC
-        """
+        sql_query = serial_query(keywords_query)
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -64,7 +75,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -74,7 +85,7 @@ def query():
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, bulk_size=3000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -87,7 +98,9 @@ def create_index(es_object, index_name):
 
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'keywords')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'keywords'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -107,48 +120,63 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Keywords ===========")
+def join_dimensions(records):
+    filter_kategorien = get_dimension("filter_kategorien")
+    kategorien = get_dimension("kategorien")
 
-    start_time = time.time()
+    joined = []
+    for fn_id, title, anzeige, anzeige_kategorie, filter_url, url, fkid, anzahl, sort in records:
+        fk = filter_kategorien.get(fkid)
+        k = kategorien.get(fk.kategorieID) if fk else None
+        title = text(title)
+        url = text(filter_url) if filter_url is not None else text(url)
 
-    es_object = connect_elasticsearch()
+        if not title:
+            prefix = concat(fk.name if fk else None, ": ") if anzeige_kategorie or (fk and fk.anzeigeKategorie) else ""
+            title = concat(k.kategorieName if k else None, " ", prefix, anzeige)
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+        sort_key = (
+            -(anzahl or 0),
+            fk.sort if fk and fk.sort else 999,
+            (fk.name or "").lower() if fk else "",
+            sort if sort else 999,
+            (text(anzeige) or "").lower(),
+        )
+        joined.append((sort_key, (title, concat("/", k.kategorieURL if k else None, "/", url), fn_id, anzahl)))
+
+    joined.sort(key=lambda row: row[0])
+    return [record for _, record in joined]
+
+
+keyword_fields = [
+    (0, "title", "str"),
+    (1, "url", "str"),
+    (2, "id", "id"),
+    (3, "anzahl", "int"),
+]
+
+to_keyword = compile_fields(keyword_fields, "to_keyword")
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    keywords = []
-    for record in records:
-        row = {
-            "title": record[0].decode() if record[0] else "",
-            "url": record[1].decode() if record[1] else "",
-        }
+def generate_keywords(records):
+    for record in join_dimensions(records):
+        yield to_keyword(record)
 
-        keywords.append(row)
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
 
-    helpers.bulk(es_object, keywords, index=ind_name)
+def main(es_object=None):
+    print("=========== Start Keywords ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('keywords')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, query, generate_keywords, index=ind_name, alias='keywords', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(keywords))
-
-    add_alias(option='keywords', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='keywords')
+    swap_alias(es_object, 'keywords', ind_name, remove_indices=expired_generations(es_object, 'keywords'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
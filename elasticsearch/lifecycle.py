@@ -0,0 +1,56 @@
+import time
+
+# new indices start with templates.loading_settings, these are the settings an index serves with
+# once it is loaded; None puts refresh_interval back to 1s
+serving_settings = {
+    "number_of_replicas": 1,
+    "refresh_interval": None,
+}
+
+# segments per shard after the load, the large indices keep a few so the merge does not take ages
+default_segments = 1
+segments = {
+    "items": 5,
+    "products": 2,
+}
+
+# force merge and waiting for the replicas block, the client timeouts are too short for that
+request_timeout = 3600
+health_timeout = "30m"
+
+
+class IndexNotReady(Exception):
+    pass
+
+
+def check_health(index_name, health):
+    if health.get("timed_out") or health.get("status") != "green":
+        raise IndexNotReady("{} is {} after {}, alias not swapped".format(index_name, health.get("status"), health_timeout))
+
+
+def finish_load(es_object, index_name, alias=None):
+    # force merge while there are no replicas, so the replicas copy the merged segments instead of
+    # merging on their own, then go live and only return once the index is green
+    start_time = time.time()
+
+    es_object.indices.forcemerge(
+        index=index_name,
+        max_num_segments=segments.get(alias, default_segments),
+        request_timeout=request_timeout
+    )
+    merge_time = time.time()
+
+    es_object.indices.put_settings(index=index_name, body={"index": serving_settings})
+    es_object.indices.refresh(index=index_name, request_timeout=request_timeout)
+
+    health = es_object.cluster.health(
+        index=index_name,
+        wait_for_status="green",
+        timeout=health_timeout,
+        request_timeout=request_timeout
+    )
+    check_health(index_name, health)
+
+    finish_time = time.time()
+    print("--- Merge: {:10.1f} seconds ---".format(merge_time - start_time))
+    print("--- Green: {:10.1f} seconds ---".format(finish_time - merge_time))
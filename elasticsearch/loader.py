@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import random
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from elasticsearch7.exceptions import ConnectionError, TransportError
+from elasticsearch7.helpers import BulkIndexError
+
+from payload import PayloadBuilder, send
+
+# threads and chunk_bytes are where the window starts, it then moves between the min_ and max_
+# values on its own; max_docs stays a fixed cap per chunk
+default_settings = {
+    "threads": 4,
+    "min_threads": 1,
+    "max_threads": 8,
+    "max_docs": 500,
+    "chunk_bytes": 5 * 1024 * 1024,
+    "min_chunk_bytes": 512 * 1024,
+    "max_chunk_bytes": 40 * 1024 * 1024,
+    "adaptive": True,
+    # share of the documents of a load into a new index that may end in the dead letters before the
+    # load is given up, so the alias stays on the previous generation
+    "max_failed_ratio": 0.001,
+}
+
+load_settings = {
+    "items": {"threads": 6, "max_threads": 12, "max_docs": 2000, "chunk_bytes": 15 * 1024 * 1024},
+    "products": {"max_docs": 2000},
+    "prices": {"max_docs": 5000},
+    "keywords": {"max_docs": 5000},
+    "filters": {"max_docs": 2000},
+    "herstellerfilters": {"max_docs": 2000},
+    "filterherstellers": {"max_docs": 2000},
+    "filterkombis": {"threads": 2, "max_docs": 2000},
+    "filtermagazinekats": {"threads": 2, "max_docs": 2000},
+    "filtermagazines": {"threads": 1},
+    "testreihes": {"threads": 1},
+    "kategorien": {"threads": 1},
+    "hersteller": {"threads": 1},
+    "producers": {"threads": 1},
+    "categories": {"threads": 1},
+}
+
+# connections per Elasticsearch client, enough for the largest window
+max_connections = max(settings.get("max_threads", default_settings["max_threads"]) for settings in load_settings.values())
+
+# a request slower per MB than this factor times the best recent one counts as congestion
+latency_factor = 1.5
+# multiplicative decrease on rising latency and on rejections (429)
+latency_decrease = 0.8
+rejection_decrease = 0.5
+# additive increase, per window of successful requests
+bytes_increase = 1024 * 1024
+
+# items with these statuses are sent again, everything else goes to the dead letters right away
+retry_statuses = (429, 502, 503, 504)
+max_retries = 6
+initial_backoff = 1
+max_backoff = 60
+
+dead_letter_dir = os.path.join(os.path.dirname(__file__), 'dead_letters')
+
+# the last window of each alias, the next load in the same process starts from there
+windows = {}
+
+
+class TooManyFailures(Exception):
+    pass
+
+
+def get_settings(alias):
+    settings = dict(default_settings)
+    settings.update(load_settings.get(alias, {}))
+    return settings
+
+
+class Window:
+    # AIMD like TCP congestion control: grows requests in flight and chunk bytes while the latency
+    # per MB stays flat, backs off on es_rejected_execution_exception (429) or rising latency
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.threads = float(settings["threads"])
+        self.chunk_bytes = float(settings["chunk_bytes"])
+        self.baseline = None
+        self.rejections = 0
+        self.decreases = 0
+
+    @property
+    def in_flight(self):
+        return int(self.threads)
+
+    @property
+    def max_bytes(self):
+        return int(self.chunk_bytes)
+
+    def decrease(self, factor):
+        self.threads = max(self.settings["min_threads"], self.threads * factor)
+        self.chunk_bytes = max(self.settings["min_chunk_bytes"], self.chunk_bytes * factor)
+        self.decreases += 1
+
+    def update(self, seconds, size, rejected):
+        if not self.settings["adaptive"]:
+            return
+
+        if rejected:
+            self.rejections += rejected
+            self.decrease(rejection_decrease)
+            return
+
+        latency = seconds / max(size, 1) * 1024 * 1024
+        if self.baseline is None:
+            self.baseline = latency
+            return
+
+        if latency > self.baseline * latency_factor:
+            self.decrease(latency_decrease)
+            # let the baseline follow a cluster that got slower for good
+            self.baseline *= 1.1
+            return
+
+        self.baseline = min(self.baseline, latency)
+        self.threads = min(self.settings["max_threads"], self.threads + 1 / self.threads)
+        self.chunk_bytes = min(self.settings["max_chunk_bytes"], self.chunk_bytes + bytes_increase / self.threads)
+
+
+def item_status(item):
+    return next(iter(item.values())).get("status")
+
+
+def retryable(ex):
+    # ConnectionError covers timeouts and refused connections, its status_code is "N/A"
+    return isinstance(ex, ConnectionError) or ex.status_code in retry_statuses
+
+
+def replayable(ex, chunk):
+    # a rejected request (429) was not applied; after a timeout or a gateway error it may have been,
+    # and sent again the actions without _id would index their documents twice
+    return ex.status_code == 429 or chunk.keyed
+
+
+def backoff(attempt):
+    return random.uniform(0.5, 1) * min(max_backoff, initial_backoff * 2 ** attempt)
+
+
+def sort_failed(chunk, failed, attempt):
+    # the positions of the items to send again and the actions that failed for good with their errors;
+    # used by send_with_retries and its asyncio twin in lookups.py
+    retry = []
+    failed_actions = []
+    for position, item in failed:
+        if item_status(item) in retry_statuses and attempt < max_retries:
+            retry.append(position)
+        else:
+            failed_actions.append((chunk.action(position), item))
+    return retry, failed_actions
+
+
+def send_with_retries(es_object, chunk, index, ignore_status):
+    # returns the actions that failed for good with their errors, how long the first response took,
+    # how many were rejected (429) and how many were sent again
+    failed_actions = []
+    seconds = None
+    rejected = 0
+    retried = 0
+    start_time = time.time()
+
+    for attempt in range(max_retries + 1):
+        try:
+            failed = send(es_object, chunk, index=index, ignore_status=ignore_status)
+        except TransportError as ex:
+            # the whole request failed; it is sent again if nothing of it was applied or if every
+            # action has an _id, otherwise the load fails instead of duplicating documents
+            if attempt == max_retries or not retryable(ex) or not replayable(ex, chunk):
+                raise
+            if ex.status_code == 429:
+                rejected += len(chunk)
+            retried += len(chunk)
+            time.sleep(backoff(attempt))
+            continue
+
+        if seconds is None:
+            seconds = time.time() - start_time
+
+        rejected += sum(1 for _, item in failed if item_status(item) == 429)
+        retry, failed_now = sort_failed(chunk, failed, attempt)
+        failed_actions.extend(failed_now)
+
+        if not retry:
+            break
+
+        retried += len(retry)
+        chunk = chunk.select(retry)
+        time.sleep(backoff(attempt))
+
+    return failed_actions, seconds, rejected, retried
+
+
+class DeadLetters:
+    # actions that could not be indexed, one JSON line each with the error and the NDJSON action lines,
+    # the file is only created for the first one
+
+    def __init__(self, alias, index):
+        self.alias = alias
+        self.index = index
+        self.path = os.path.join(dead_letter_dir, "{}.{}.ndjson".format(alias, time.strftime("%Y%m%d-%H%M%S")))
+        self.spool = None
+        self.count = 0
+
+    def write(self, action, item):
+        if self.spool is None:
+            os.makedirs(dead_letter_dir, exist_ok=True)
+            self.spool = open(self.path, 'a', encoding='utf-8')
+
+        self.spool.write(json.dumps({
+            "alias": self.alias,
+            "index": self.index,
+            "error": item,
+            "action": action.decode(),
+        }, default=str) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+
+
+def check_failures(alias, index, success, failed, settings):
+    total = success + failed
+    if total and failed / total > settings["max_failed_ratio"]:
+        raise TooManyFailures("{} of {} documents failed, more than {:.2%} of {}, {} not swapped in".format(
+            failed, total, settings["max_failed_ratio"], alias, index
+        ))
+
+
+def parallel_bulk(es_object, actions, index=None, alias=None, ignore_status=(), raise_on_error=False, **overrides):
+    # like payload.bulk, but several chunks are sent at once while the next ones are built; how many
+    # and how big follows the Window of this alias. Rejected items are retried with backoff, items
+    # that still fail are written to the dead letters instead of stopping the load, up to the
+    # max_failed_ratio of the alias
+    alias = alias or index
+    settings = get_settings(alias)
+    settings.update(overrides)
+
+    window = windows.get(alias)
+    if window is None or overrides:
+        window = Window(settings)
+        windows[alias] = window
+    window.rejections = 0
+    window.decreases = 0
+
+    success = 0
+    retried = 0
+    errors = []
+    pending = {}
+    dead_letters = DeadLetters(alias, index)
+    builder = PayloadBuilder(max_docs=settings["max_docs"], max_bytes=window.max_bytes)
+
+    def collect(futures):
+        nonlocal success, retried
+        for future in futures:
+            chunk = pending.pop(future)
+            failed_actions, seconds, rejected, chunk_retried = future.result()
+            window.update(seconds, len(chunk.body), rejected)
+            success += len(chunk) - len(failed_actions)
+            retried += chunk_retried
+            for action, item in failed_actions:
+                dead_letters.write(action, item)
+                errors.append(item)
+        builder.max_bytes = window.max_bytes
+
+    def submit(executor, chunk):
+        while len(pending) >= window.in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending[executor.submit(send_with_retries, es_object, chunk, index, ignore_status)] = chunk
+
+    try:
+        with ThreadPoolExecutor(max_workers=settings["max_threads"]) as executor:
+            for action in actions:
+                chunk = builder.add(action)
+                if chunk is not None:
+                    submit(executor, chunk)
+
+            chunk = builder.flush()
+            if chunk is not None:
+                submit(executor, chunk)
+
+            collect(list(pending))
+    finally:
+        dead_letters.close()
+
+    print("--- Bulk window {}: {} requests, {:.1f} MB chunks, {} rejections, {} decreases ---".format(
+        alias, window.in_flight, window.chunk_bytes / 1024 / 1024, window.rejections, window.decreases
+    ))
+    print("--- Bulk {}: {} indexed, {} retried, {} failed ---".format(alias, success, retried, dead_letters.count))
+    if dead_letters.count:
+        print("Dead letters: {}".format(dead_letters.path))
+
+    if errors and raise_on_error:
+        raise BulkIndexError("{} document(s) failed to index.".format(len(errors)), errors)
+    # only loads into a new index are checked; the delta and CDC updates write to the live alias,
+    # there is nothing to keep from going live and raising would only replay the same documents
+    if index is not None:
+        check_failures(alias, index, success, len(errors), settings)
+    return success, errors
@@ -0,0 +1,220 @@
+import os
+import sys
+import asyncio
+import time
+from functools import partial
+
+import aiomysql
+from elasticsearch7 import AsyncElasticsearch, Elasticsearch
+from elasticsearch7.exceptions import TransportError
+from dotenv import load_dotenv
+
+from alias import swap_aliases
+from delta import keyed_actions
+from dimensions import dimension_queries, put_dimension
+from extract import serial_query
+from generations import expired_generations, new_generation
+from indexers import load_script
+from lifecycle import finish_load
+from loader import (
+    DeadLetters, backoff, check_failures, default_settings, get_settings, max_retries, replayable, retryable, sort_failed
+)
+from payload import chunks, failed_items, filter_path
+from templates import put_template
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+DB_HOST = os.environ.get("DB_HOST")
+DB_USER = os.environ.get("DB_USER")
+DB_PASS = os.environ.get("DB_PASS")
+DATABASE = os.environ.get("DB_DATABASE")
+
+# the small lookup indices: alias, script, the script's SQL (None: the script builds its records from
+# the shared dimensions), document generator, whether the documents get their id as _id; producers and
+# categories have no row key, a chunk of theirs that timed out fails the load instead of being resent
+lookups = [
+    ("producers", "producer", None, "generate_producers", False),
+    ("keywords", "keyword", "keywords_query", "generate_keywords", True),
+    ("categories", "category", "categories_query", "generate_categories", False),
+    ("kategorien", "FilterKategorien", None, "generate_kategorien", True),
+    ("hersteller", "FilterHersteller", None, "generate_hersteller", True),
+    ("filtermagazines", "FilterMagazine", "filtermagazines_query", "generate_filtermagazines", True),
+    ("filtermagazinekats", "FilterMagazineKat", "filtermagazinekats_query", "generate_filtermagazinekats", True),
+    ("testreihes", "Filtertestreihe", "testreihes_query", "generate_testreihes", True),
+    ("filterkombis", "FilterFilterkombi", "filterkombis_query", "generate_filterkombis", True),
+]
+
+# connections of both pools, and bulk requests one index keeps in flight
+max_connections = 10
+max_requests = 4
+
+# the lookups are far below one shard each, so there is no sizing pre-flight
+lookup_settings = {"settings": {"number_of_shards": 1}}
+
+
+def connect_elasticsearch():
+    # the async client sends the bulk requests; templates, force merge and the alias swap are the
+    # blocking calls of templates.py, lifecycle.py and alias.py, run in threads on the sync client
+    return (
+        AsyncElasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections),
+        Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=len(lookups))
+    )
+
+
+async def blocking(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(function, *args, **kwargs))
+
+
+async def connect_mysql():
+    # text columns come back as bytes, like from the prepared mysql.connector cursors the field
+    # conversions of the scripts are written for
+    return await aiomysql.create_pool(
+        host=DB_HOST,
+        user=DB_USER,
+        password=DB_PASS,
+        db=DATABASE,
+        maxsize=max_connections,
+        use_unicode=False
+    )
+
+
+async def fetch_all(pool, sql_query, params=()):
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql_query, params)
+            return await cursor.fetchall()
+
+
+async def load_dimensions(pool):
+    tables = list(dimension_queries)
+    results = await asyncio.gather(*(fetch_all(pool, dimension_queries[table][0]) for table in tables))
+    for table, records in zip(tables, results):
+        put_dimension(table, records)
+
+
+async def send_with_retries(es_object, chunk, index):
+    # the asyncio side of loader.send_with_retries, returns the actions that failed for good
+    failed_actions = []
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = await es_object.bulk(body=chunk.body, index=index, filter_path=filter_path)
+        except TransportError as ex:
+            if attempt == max_retries or not retryable(ex) or not replayable(ex, chunk):
+                raise
+            await asyncio.sleep(backoff(attempt))
+            continue
+
+        retry, failed_now = sort_failed(chunk, failed_items(response), attempt)
+        failed_actions.extend(failed_now)
+
+        if not retry:
+            break
+
+        chunk = chunk.select(retry)
+        await asyncio.sleep(backoff(attempt))
+
+    return failed_actions
+
+
+async def bulk(es_object, documents, index, alias):
+    semaphore = asyncio.Semaphore(max_requests)
+    dead_letters = DeadLetters(alias, index)
+
+    async def send(chunk):
+        async with semaphore:
+            failed_actions = await send_with_retries(es_object, chunk, index)
+        for action, item in failed_actions:
+            dead_letters.write(action, item)
+        return len(chunk) - len(failed_actions)
+
+    try:
+        parts = chunks(documents, max_docs=default_settings["max_docs"], max_bytes=default_settings["chunk_bytes"])
+        sent = await asyncio.gather(*(send(chunk) for chunk in parts))
+    finally:
+        dead_letters.close()
+
+    if dead_letters.count:
+        print("Dead letters: {}".format(dead_letters.path))
+    check_failures(alias, index, sum(sent), dead_letters.count, get_settings(alias))
+    return sum(sent)
+
+
+async def build(es_object, control, pool, alias, script, query_name, generator_name, keyed):
+    # one lookup index up to the point where its alias can be moved, returns the new generation
+    module = load_script(script)
+    start_time = time.time()
+
+    ind_name = new_generation(alias)
+    await blocking(put_template, control, alias)
+    await es_object.indices.create(index=ind_name, ignore=400, body=lookup_settings)
+
+    if query_name is None:
+        records = module.query()
+    else:
+        sql_query = serial_query(getattr(module, query_name))
+        params = ()
+        if module.limit_count is not None:
+            sql_query += " LIMIT %s"
+            params = (module.limit_count,)
+        records = await fetch_all(pool, sql_query, params)
+
+    documents = getattr(module, generator_name)(records)
+    if keyed:
+        documents = keyed_actions(documents)
+    imported = await bulk(es_object, documents, ind_name, alias)
+
+    await blocking(finish_load, control, ind_name, alias)
+    print("--- {}: {} records in {:10.1f} seconds ---".format(alias, imported, time.time() - start_time))
+    return ind_name
+
+
+def swap(es_object, swaps):
+    # every alias in one _aliases request, then the expired generations in one delete
+    remove_indices = [index for alias in swaps for index in expired_generations(es_object, alias)]
+    return swap_aliases(es_object, swaps, remove_indices)
+
+
+async def run(names=None):
+    print("=========== Start Lookups ===========")
+
+    start_time = time.time()
+    selected = [lookup for lookup in lookups if not names or lookup[0] in names]
+
+    es_object, control = connect_elasticsearch()
+    pool = await connect_mysql()
+    try:
+        await load_dimensions(pool)
+        dimension_time = time.time()
+        print("--- Dimensions: {:10.1f} seconds ---".format(dimension_time - start_time))
+
+        results = await asyncio.gather(*(build(es_object, control, pool, *lookup) for lookup in selected), return_exceptions=True)
+        elastic_time = time.time()
+
+        swaps = {}
+        for lookup, result in zip(selected, results):
+            if isinstance(result, Exception):
+                print("{} failed: {}".format(lookup[0], result))
+            else:
+                swaps[lookup[0]] = result
+
+        if swaps:
+            await blocking(swap, control, swaps)
+        alias_time = time.time()
+    finally:
+        pool.close()
+        await pool.wait_closed()
+        await es_object.close()
+        control.close()
+
+    print("--- Indices: {:10.1f} seconds ---".format(elastic_time - dimension_time))
+    print("--- Alias: {:10.1f} seconds ---".format(alias_time - elastic_time))
+    print("--- Total: {:10.1f} seconds ---".format(alias_time - start_time))
+    print("============ End Lookups ===========")
+    return len(swaps) == len(selected)
+
+
+if __name__ == '__main__':
+    if not asyncio.run(run(sys.argv[1:])):
+        sys.exit(1)
@@ -0,0 +1,22 @@
+# longer values are not put into the keyword subfield, they still are in the analyzed text
+ignore_above = 1024
+
+
+def sortable_text(facet=False):
+    # analyzed text for matching plus a keyword subfield with doc_values for sorting and aggregations,
+    # sort and aggregate on "<field>.keyword"; fielddata on the text itself is not needed any more.
+    # Global ordinals are built at refresh only for the facets, everything else builds them on
+    # the first aggregation
+    keyword = {
+        "type": "keyword",
+        "ignore_above": ignore_above,
+    }
+    if facet:
+        keyword["eager_global_ordinals"] = True
+
+    return {
+        "type": "text",
+        "fields": {
+            "keyword": keyword
+        }
+    }
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from elasticsearch7 import Elasticsearch
+from dotenv import load_dotenv
+
+from alias import commit_swaps, defer_swaps, discard_swaps
+from dimensions import get_dimension, invalidate
+from indexers import load_script
+from loader import max_connections
+
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(dotenv_path)
+
+# global limit of indexers running at the same time, each of them still has its own extract workers
+# and bulk threads on top of that
+max_parallel = 4
+
+state_path = os.path.join(os.path.dirname(__file__), 'orchestrator_state.json')
+
+# task -> (script, tasks it has to wait for, seconds it takes until there is a measured duration);
+# the dimensions task only loads the shared lookups once instead of every indexer racing for them
+tasks = {
+    "dimensions": (None, (), 30),
+    "items": ("getAllItems", (), 3600),
+    "products": ("product", ("dimensions",), 600),
+    "prices": ("price", (), 300),
+    "keywords": ("keyword", ("dimensions",), 120),
+    "filters": ("FilterFilter", ("dimensions",), 120),
+    "herstellerfilters": ("FilterHerstellerfilter", ("dimensions",), 300),
+    "filterherstellers": ("FilterFilterHersteller", ("dimensions",), 60),
+    "filterkombis": ("FilterFilterkombi", (), 60),
+    "filtermagazinekats": ("FilterMagazineKat", (), 30),
+    "filtermagazines": ("FilterMagazine", (), 30),
+    "testreihes": ("Filtertestreihe", (), 30),
+    "kategorien": ("FilterKategorien", ("dimensions",), 10),
+    "hersteller": ("FilterHersteller", ("dimensions",), 10),
+    "producers": ("producer", ("dimensions",), 10),
+    "categories": ("category", (), 30),
+}
+
+
+def connect_elasticsearch(parallel):
+    # one client for every task, its pool is sized for all of them bulk loading at once
+    _es = None
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections * parallel)
+    if _es.ping():
+        print('Connect to Elasticsearch')
+    else:
+        print('it could not connect!')
+    return _es
+
+
+def load_durations():
+    if not os.path.exists(state_path):
+        return {}
+
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def save_durations(durations):
+    state = load_durations()
+    state.update(durations)
+
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def selected_tasks(names):
+    # the named tasks and everything they depend on
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in tasks:
+            raise KeyError("unknown task {}, one of: {}".format(name, ", ".join(tasks)))
+        if name not in selected:
+            selected.add(name)
+            pending.extend(tasks[name][1])
+    return selected
+
+
+def ranks(selected, durations):
+    # length of the longest path from the start of a task to the end of the run, the task with the
+    # longest one goes first; items lead, the short filter jobs fill the threads that are left
+    dependents = {name: [other for other in selected if name in tasks[other][1]] for name in selected}
+    rank = {}
+
+    def upward(name):
+        if name not in rank:
+            cost = durations.get(name, tasks[name][2])
+            rank[name] = cost + max((upward(other) for other in dependents[name]), default=0)
+        return rank[name]
+
+    for name in selected:
+        upward(name)
+    return rank
+
+
+def run_task(name, es_object, **arguments):
+    # arguments go to the script's main(), e.g. delta=True for items and prices
+    script = tasks[name][0]
+    start_time = time.time()
+
+    if script is None:
+        # a fresh read even when this process loaded them before
+        invalidate()
+        for table in ("kategorien", "hersteller", "filter_kategorien"):
+            get_dimension(table)
+    else:
+        load_script(script).main(es_object=es_object, **arguments)
+    return time.time() - start_time
+
+
+def run(names=None, parallel=max_parallel, atomic=False):
+    print("=========== Start Orchestrator ===========")
+
+    start_time = time.time()
+
+    selected = selected_tasks(names or list(tasks))
+    durations = load_durations()
+    rank = ranks(selected, durations)
+
+    es_object = connect_elasticsearch(parallel)
+    if atomic:
+        # all aliases move together at the end, and only if every task succeeded
+        defer_swaps()
+
+    waiting = {name: set(tasks[name][1]) for name in selected}
+    order = itertools.count()
+    ready = []
+    results = {}
+
+    def release():
+        for name in list(waiting):
+            if not waiting[name]:
+                del waiting[name]
+                heapq.heappush(ready, (-rank[name], next(order), name))
+
+    def skip(failed):
+        # nothing runs on top of a failed task, neither directly nor further down
+        for other in [other for other in waiting if failed in waiting[other]]:
+            del waiting[other]
+            results[other] = None
+            print("{} skipped, {} failed".format(other, failed))
+            skip(other)
+
+    release()
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        while ready or running:
+            while ready and len(running) < parallel:
+                _, _, name = heapq.heappop(ready)
+                print("--- Start {} (critical path {:10.1f} seconds) ---".format(name, rank[name]))
+                running[executor.submit(run_task, name, es_object)] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as ex:
+                    print("{} failed: {}".format(name, ex))
+                    results[name] = None
+
+                if results[name] is None:
+                    skip(name)
+                for other in waiting:
+                    waiting[other].discard(name)
+            release()
+
+    failed = [name for name in selected if results.get(name) is None]
+    if atomic:
+        if failed:
+            print("--- Alias swaps discarded: {} ---".format(", ".join(discard_swaps()) or "-"))
+        else:
+            commit_swaps(es_object)
+
+    save_durations({name: seconds for name, seconds in results.items() if seconds is not None})
+
+    for name in sorted(selected, key=lambda name: -rank[name]):
+        if results.get(name) is None:
+            print("--- {}: failed ---".format(name))
+        else:
+            print("--- {}: {:10.1f} seconds ---".format(name, results[name]))
+
+    total = time.time() - start_time
+    print("--- Sum of tasks: {:10.1f} seconds ---".format(sum(seconds for seconds in results.values() if seconds)))
+    print("--- Total: {:10.1f} seconds ---".format(total))
+    print("============ End Orchestrator ===========")
+    return not failed
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    parallel = max_parallel
+    if "--parallel" in args:
+        position = args.index("--parallel")
+        parallel = int(args[position + 1])
+        del args[position:position + 2]
+    atomic = "--atomic" in args
+    names = [arg for arg in args if arg != "--atomic"]
+
+    if not run(names, parallel=parallel, atomic=atomic):
+        sys.exit(1)
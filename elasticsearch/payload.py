@@ -0,0 +1,174 @@
+import json
+import datetime
+from array import array
+from decimal import Decimal
+
+from elasticsearch7.helpers import BulkIndexError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# a chunk is sent once it holds max_docs actions or max_bytes of payload, whichever comes first
+max_docs = 500
+max_bytes = 10 * 1024 * 1024
+
+# only what is needed to find failed actions, the full bulk response repeats every _index and _id
+filter_path = "took,errors,items.*.status,items.*.error"
+
+meta_fields = ("_op_type", "_index", "_id", "_routing")
+
+
+def default(value):
+    # same conversions as the client's JSONSerializer for what MySQL returns
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    raise TypeError("Unable to serialize {!r} (type: {})".format(value, type(value)))
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=default)
+else:
+    def dumps(value):
+        return json.dumps(value, default=default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+index_line = b'{"index":{}}\n'
+
+
+def action_lines(action):
+    # the meta fields are popped off the action itself, the generators hand over fresh dicts
+    # and this saves a copy per document
+    if "_op_type" not in action and "_index" not in action and "_routing" not in action:
+        if "_id" not in action:
+            return index_line + dumps(action) + b'\n'
+        return b'{"index":{"_id":' + dumps(action.pop("_id")) + b'}}\n' + dumps(action) + b'\n'
+
+    op_type = action.pop("_op_type", "index")
+    meta = {field: action.pop(field) for field in meta_fields[1:] if field in action}
+    line = dumps({op_type: meta}) + b'\n'
+
+    if op_type == "delete":
+        return line
+    return line + dumps(action) + b'\n'
+
+
+class Chunk:
+    # one ready-to-send bulk body, offsets[n] is where the n-th action starts in it
+
+    __slots__ = ("body", "offsets")
+
+    def __init__(self, body, offsets):
+        self.body = body
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def action(self, position):
+        end = self.offsets[position + 1] if position + 1 < len(self.offsets) else len(self.body)
+        return self.body[self.offsets[position]:end]
+
+    @property
+    def keyed(self):
+        # every action names its document; an index action without _id adds a new one each time
+        return all(b'"_id"' in self.action(position).split(b'\n', 1)[0] for position in range(len(self)))
+
+    def select(self, positions):
+        # a smaller chunk with only these actions, without serializing them again
+        parts = [self.action(position) for position in positions]
+        offsets = array('q')
+        end = 0
+        for part in parts:
+            offsets.append(end)
+            end += len(part)
+        return Chunk(b"".join(parts), offsets)
+
+
+class PayloadBuilder:
+
+    def __init__(self, max_docs=max_docs, max_bytes=max_bytes):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.parts = []
+        self.offsets = array('q')
+        self.size = 0
+
+    def add(self, action):
+        # returns the finished chunk once this action filled it up, otherwise None; an action that
+        # already went through action_lines() is taken as it is
+        lines = action if isinstance(action, bytes) else action_lines(action)
+
+        chunk = None
+        if self.parts and self.size + len(lines) > self.max_bytes:
+            chunk = self.flush()
+
+        self.offsets.append(self.size)
+        self.parts.append(lines)
+        self.size += len(lines)
+
+        if chunk is None and len(self.parts) >= self.max_docs:
+            chunk = self.flush()
+        return chunk
+
+    def flush(self):
+        if not self.parts:
+            return None
+
+        # one join per chunk, bytes go through the client and the connection untouched
+        chunk = Chunk(b"".join(self.parts), self.offsets)
+        self.parts.clear()
+        self.offsets = array('q')
+        self.size = 0
+        return chunk
+
+
+def chunks(actions, max_docs=max_docs, max_bytes=max_bytes):
+    builder = PayloadBuilder(max_docs=max_docs, max_bytes=max_bytes)
+
+    for action in actions:
+        chunk = builder.add(action)
+        if chunk is not None:
+            yield chunk
+
+    chunk = builder.flush()
+    if chunk is not None:
+        yield chunk
+
+
+def failed_items(response, ignore_status=()):
+    if not response.get("errors"):
+        return []
+
+    errors = []
+    for position, item in enumerate(response["items"]):
+        op_type, result = next(iter(item.items()))
+        if result.get("status", 500) >= 300 and result.get("status") not in ignore_status:
+            errors.append((position, {op_type: result}))
+    return errors
+
+
+def send(es_object, chunk, index=None, ignore_status=()):
+    response = es_object.bulk(body=chunk.body, index=index, filter_path=filter_path)
+    return failed_items(response, ignore_status)
+
+
+def bulk(es_object, actions, index=None, max_docs=max_docs, max_bytes=max_bytes, ignore_status=(), raise_on_error=True):
+    # drop-in for helpers.bulk, returns (successful actions, errors)
+    success = 0
+    errors = []
+
+    for chunk in chunks(actions, max_docs=max_docs, max_bytes=max_bytes):
+        failed = send(es_object, chunk, index=index, ignore_status=ignore_status)
+        success += len(chunk) - len(failed)
+        errors.extend(item for _, item in failed)
+
+    if errors and raise_on_error:
+        raise BulkIndexError("{} document(s) failed to index.".format(len(errors)), errors)
+    return success, errors
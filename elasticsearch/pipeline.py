@@ -0,0 +1,189 @@
+import queue
+import threading
+import time
+
+from delta import keyed_actions
+from loader import parallel_bulk
+from payload import action_lines
+
+# records per batch between the stages, and batches a queue holds before the stage in front of it
+# has to wait; at most about 2 * queue_depth * batch_size records are in memory at once
+batch_size = 2000
+queue_depth = 4
+
+# documents are built and serialized here, off the thread that feeds the bulk requests
+transform_workers = 1
+
+poll_seconds = 0.1
+
+end = object()
+
+
+class PipelineFailed(Exception):
+    pass
+
+
+class Stage:
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+        self.end_time = None
+        self.waited = 0.0
+        self.count = 0
+
+    @property
+    def busy(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time - self.waited
+
+
+class Pipeline:
+    # extract -> records queue -> transform -> actions queue -> bulk; every queue is bounded, so a slow
+    # stage holds up the ones in front of it instead of piling up rows
+
+    def __init__(self, extract, transform, keyed=False, batch_size=batch_size, queue_depth=queue_depth, workers=transform_workers):
+        self.extract = extract
+        self.transform = transform
+        self.keyed = keyed
+        self.batch_size = batch_size
+        self.workers = workers
+        self.records = queue.Queue(maxsize=queue_depth)
+        self.actions = queue.Queue(maxsize=queue_depth)
+        self.stopped = threading.Event()
+        self.errors = []
+        self.stages = [Stage("Query"), Stage("Json"), Stage("Elastic")]
+
+    def put(self, stage, target, item):
+        # False once the pipeline stopped, the stage then gives up instead of waiting forever
+        start_time = time.time()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    target.put(item, timeout=poll_seconds)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            stage.waited += time.time() - start_time
+
+    def get(self, stage, source):
+        start_time = time.time()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    return source.get(timeout=poll_seconds)
+                except queue.Empty:
+                    pass
+            return end
+        finally:
+            stage.waited += time.time() - start_time
+
+    def fail(self, stage, ex):
+        print("{} stage failed: {}".format(stage.name, ex))
+        self.errors.append((stage.name, ex))
+        self.stopped.set()
+
+    def run_extract(self):
+        stage = self.stages[0]
+        stage.start_time = time.time()
+
+        try:
+            batch = []
+            for record in self.extract():
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    stage.count += len(batch)
+                    if not self.put(stage, self.records, batch):
+                        return
+                    batch = []
+
+            stage.count += len(batch)
+            if batch and not self.put(stage, self.records, batch):
+                return
+            for _ in range(self.workers):
+                self.put(stage, self.records, end)
+        except Exception as ex:
+            self.fail(stage, ex)
+        finally:
+            stage.end_time = time.time()
+
+    def run_transform(self):
+        stage = self.stages[1]
+        if stage.start_time is None:
+            stage.start_time = time.time()
+
+        try:
+            while True:
+                batch = self.get(stage, self.records)
+                if batch is end:
+                    break
+
+                documents = self.transform(batch)
+                if self.keyed:
+                    documents = keyed_actions(documents)
+                lines = [action_lines(document) for document in documents]
+                stage.count += len(lines)
+
+                if not self.put(stage, self.actions, lines):
+                    return
+            self.put(stage, self.actions, end)
+        except Exception as ex:
+            self.fail(stage, ex)
+        finally:
+            stage.end_time = time.time()
+
+    def serialized_actions(self):
+        stage = self.stages[2]
+        finished = 0
+
+        while finished < self.workers:
+            lines = self.get(stage, self.actions)
+            if lines is end:
+                if self.stopped.is_set():
+                    break
+                finished += 1
+                continue
+            for line in lines:
+                yield line
+
+        if self.errors:
+            name, ex = self.errors[0]
+            raise PipelineFailed("{} stage failed: {}".format(name, ex))
+
+    def run(self, es_object, index=None, alias=None, **overrides):
+        threads = [threading.Thread(target=self.run_extract)]
+        threads += [threading.Thread(target=self.run_transform) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        stage = self.stages[2]
+        stage.start_time = time.time()
+        try:
+            success, errors = parallel_bulk(es_object, self.serialized_actions(), index=index, alias=alias, **overrides)
+            stage.count = success
+            return success, errors
+        except Exception:
+            self.stopped.set()
+            raise
+        finally:
+            stage.end_time = time.time()
+            for thread in threads:
+                thread.join()
+            self.report(time.time() - stage.start_time)
+
+    def report(self, total):
+        # busy is the time a stage did its work and did not wait on a queue; the total stays close to
+        # the busiest stage as long as the others keep up
+        for stage in self.stages:
+            print("--- {}: {:10.1f} seconds busy, {:10.1f} waiting, {} ---".format(stage.name, stage.busy, stage.waited, stage.count))
+        print("--- Total: {:10.1f} seconds ---".format(total))
+
+
+def run_pipeline(es_object, extract, transform, index=None, alias=None, keyed=False, **overrides):
+    # extract is called once in the extract thread and returns the records, transform turns a batch of
+    # them into documents; returns what parallel_bulk returns
+    pipeline = Pipeline(extract, transform, keyed=keyed)
+    return pipeline.run(es_object, index=index, alias=alias, **overrides)
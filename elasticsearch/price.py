@@ -1,10 +1,20 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
+import sys
 import time
-
-from alias import add_alias
+from functools import partial
+
+from alias import swap_alias
+from delta import changed_ids, current_mark, delta_actions, load_mark, save_mark
+from extract import fetch_ids, parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections, parallel_bulk
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -18,8 +28,25 @@ TYPESENSE_HOST = os.environ.get("TYPESENSE_HOST")
 TYPESENSE_KEY = os.environ.get("TYPESENSE_KEY")
 
 limit_count = None
-new_index = "primary_prices"
-old_index = "secondary_prices"
+workers = 4
+
+prices_query = """
+            SELECT
+                produktID, preis
+            FROM
+                pname2pid_angebote
+            WHERE
+                {range}
+        """
+
+prices_changed_query = """
+            SELECT
+                produktID
+            FROM
+                pname2pid_angebote
+            WHERE
+                aktualisiert > %s
+        """
 
 
 def query():
@@ -27,6 +54,15 @@ def query():
     initial_cursor = None
 
     try:
+        if workers > 1:
+            return list(parallel_query(
+                prices_query,
+                key_column="produktID",
+                key_table="pname2pid_angebote",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
         initial_db = mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
@@ -36,12 +72,7 @@ def query():
 
         initial_cursor = initial_db.cursor(prepared=True)
 
-        sql_query = """
-            SELECT
-                produktID, preis
-            FROM
-                pname2pid_angebote
-        """
+        sql_query = serial_query(prices_query)
 
         if limit_count is not None:
             sql_query += " LIMIT %s"
@@ -53,7 +84,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -61,9 +92,24 @@ def query():
             initial_db.close()
 
 
+def stream_query():
+    # streams like product.stream_query
+    if workers > 1:
+        yield from parallel_query(
+            prices_query,
+            key_column="produktID",
+            key_table="pname2pid_angebote",
+            workers=workers,
+            limit_count=limit_count
+        )
+        return
+
+    yield from query()
+
+
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, bulk_size=3000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -76,7 +122,9 @@ def create_index(es_object, index_name):
 
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'prices')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'prices'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -96,48 +144,73 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Prices ===========")
+price_fields = [
+    (0, "id", "raw"),
+    (1, "price", "bytes"),
+]
+
+to_price = compile_fields(price_fields, "to_price")
+
+
+def generate_prices(records):
+    for record in records:
+        yield to_price(record)
+
+
+def delta_main(mark, es_object=None):
+    print("=========== Start Prices delta ===========")
 
     start_time = time.time()
 
-    es_object = connect_elasticsearch()
+    es_object = es_object or connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+    try:
+        next_mark = current_mark()
+        changed = changed_ids(prices_changed_query, mark)
+        query_time = time.time()
+        print("--- Changed: {:10.1f} seconds ---".format(query_time - start_time))
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
+        records = fetch_ids(prices_query, "produktID", changed)
+        imported, _ = parallel_bulk(es_object, delta_actions('prices', changed, generate_prices(records)), alias='prices', ignore_status=(404,))
+    except mysql.connector.Error as e:
+        print("Failed to query table in MySQL: {}".format(e))
+        raise
+
+    save_mark('prices', next_mark)
+    elastic_time = time.time()
+    print("--- Delta: {:10.1f} seconds ---".format(elastic_time - query_time))
+    print("Changed Records:", len(changed))
+    print("Updated Records:", imported)
+
+    print("============ End Prices delta ===========")
 
-    prices = []
-    for record in records:
-        row = {
-            "id": record[0],
-            "price": record[1].decode() if record[1] else "",
-        }
 
-        prices.append(row)
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+def main(delta=False, es_object=None):
+    mark = load_mark('prices') if delta else None
+    if mark is not None:
+        return delta_main(mark, es_object=es_object)
+    if delta:
+        print("No high-water mark for prices yet, running a full rebuild")
+
+    print("=========== Start Prices ===========")
+
+    es_object = es_object or connect_elasticsearch()
+    next_mark = current_mark()
+
+    ind_name = new_generation('prices')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, prices, index=ind_name)
+    imported, _ = run_pipeline(es_object, stream_query, generate_prices, index=ind_name, alias='prices', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(prices))
-
-    add_alias(option='prices', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='prices')
+    # the mark moves with the alias, under orchestrator --atomic only if the swaps are committed
+    swap_alias(
+        es_object, 'prices', ind_name,
+        remove_indices=expired_generations(es_object, 'prices'),
+        after_swap=partial(save_mark, 'prices', next_mark)
+    )
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
@@ -146,4 +219,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(delta='--delta' in sys.argv)
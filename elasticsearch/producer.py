@@ -1,9 +1,16 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
-from alias import add_alias
+from alias import swap_alias
+from dimensions import get_dimension
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -17,55 +24,25 @@ TYPESENSE_HOST = os.environ.get("TYPESENSE_HOST")
 TYPESENSE_KEY = os.environ.get("TYPESENSE_KEY")
 
 limit_count = None
-new_index = "primary_producers"
-old_index = "secondary_producers"
 
 
 def query():
-    initial_db = None
-    initial_cursor = None
-
+    # hersteller is one of the shared dimensions, so the index is built from the cache instead of another scan
     try:
-        initial_db = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DATABASE
-        )
-
-        initial_cursor = initial_db.cursor(prepared=True)
-
-        sql_query = """
-            SELECT
-                HERSTELLERNAME title, IF(STRCMP(URLSTRUKTUR, ''), URLSTRUKTUR, HERSTELLERNAME) url
-            FROM
-                hersteller
-            ORDER BY
-                anzahl DESC,
-                HERSTELLERNAME ASC
-        """
-
-        if limit_count is not None:
-            sql_query += " LIMIT %s"
-            initial_cursor.execute(sql_query, (limit_count,))
-        else:
-            initial_cursor.execute(sql_query)
-
-        return initial_cursor.fetchall()
-
+        hersteller = get_dimension("hersteller")
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
-    finally:
-        if initial_db and initial_db.is_connected():
-            initial_cursor.close()
-            initial_db.close()
+    records = sorted(hersteller.values(), key=lambda h: (-(h.anzahl or 0), (h.HERSTELLERNAME or "").lower()))
+    records = [(h.HERSTELLERNAME, h.URLSTRUKTUR if h.URLSTRUKTUR else h.HERSTELLERNAME) for h in records]
+
+    return records[:limit_count] if limit_count is not None else records
 
 
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, bulk_size=3000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=500, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -74,16 +51,18 @@ def connect_elasticsearch():
 
 
 def create_index(es_object, index_name):
-    exist = True
+    created = False
 
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400)
-            exist = False
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'producers')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'producers'))
+        created = True
     except Exception as ex:
         print(str(ex))
     finally:
-        return exist
+        return created
 
 
 def get_index_name(es_object, index_name):
@@ -98,48 +77,33 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Producers ===========")
+producer_fields = [
+    (0, "title", "str"),
+    (1, "url", "str"),
+]
 
-    start_time = time.time()
+to_producer = compile_fields(producer_fields, "to_producer")
 
-    es_object = connect_elasticsearch()
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
+def generate_producers(records):
+    for record in records:
+        yield to_producer(record)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
 
-    producers = []
-    for record in records:
-        row = {
-            "title": record[0].decode() if record[0] else "",
-            "url": record[1].decode() if record[1] else "",
-        }
+def main(es_object=None):
+    print("=========== Start Producers ===========")
+
+    es_object = es_object or connect_elasticsearch()
 
-        producers.append(row)
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
+    ind_name = new_generation('producers')
+    create_index(es_object=es_object, index_name=ind_name)
 
-    helpers.bulk(es_object, producers, index=ind_name)
+    imported, _ = run_pipeline(es_object, query, generate_producers, index=ind_name, alias='producers')
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(producers))
-
-    add_alias(option='producers', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='producers')
+    swap_alias(es_object, 'producers', ind_name, remove_indices=expired_generations(es_object, 'producers'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
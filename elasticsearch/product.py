@@ -1,10 +1,18 @@
 import os
 import mysql.connector
-from elasticsearch7 import Elasticsearch, helpers
+from elasticsearch7 import Elasticsearch
 from dotenv import load_dotenv
 import time
 
-from alias import add_alias
+from alias import swap_alias
+from dimensions import concat, get_dimension
+from extract import parallel_query, serial_query
+from fields import compile_fields
+from generations import expired_generations, new_generation
+from lifecycle import finish_load
+from loader import max_connections
+from pipeline import run_pipeline
+from templates import create_settings, put_template
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -15,8 +23,23 @@ DB_PASS = os.environ.get("DB_PASS")
 DATABASE = os.environ.get("DB_DATABASE")
 
 limit_count = None
-new_index = "primary_products"
-old_index = "secondary_products"
+workers = 4
+
+products_query = """
+            SELECT
+                pm.id AS productID, pm.PNAME AS productName, pm.PURL AS productUrl, pr.pfad AS img,
+                pm.TESTS AS tests, pm.SCORE AS score, pa.punkte AS points, pm.kategorieID, pm.herstellerID
+            FROM
+                pname2pid_mapping  pm
+            INNER JOIN
+                produktbilder pr ON (pm.id = pr.produktID)
+            INNER JOIN
+                pname2pid_angebote pa ON (pa.produktID = pm.id)
+            WHERE
+                {range} AND
+                pr.pos = 1 AND
+                pr.groesse = 'S'
+        """
 
 
 def query():
@@ -24,6 +47,15 @@ def query():
     initial_cursor = None
 
     try:
+        if workers > 1:
+            return list(parallel_query(
+                products_query,
+                key_column="pm.id",
+                key_table="pname2pid_mapping",
+                workers=workers,
+                limit_count=limit_count
+            ))
+
         initial_db = mysql.connector.connect(
             host=DB_HOST,
             user=DB_USER,
@@ -33,25 +65,7 @@ def query():
 
         initial_cursor = initial_db.cursor(prepared=True)
 
-        sql_query = """
-            SELECT
-                pm.id AS productID, pm.PNAME AS productName, pm.PURL AS productUrl, pr.pfad AS img,
-                pm.TESTS AS tests, pm.SCORE AS score, pa.punkte AS points, CONCAT(k.kategorieName, ", ",
-                h.herstellerName) AS keyword
-            FROM
-                pname2pid_mapping  pm
-            INNER JOIN
-                produktbilder pr ON (pm.id = pr.produktID)
-            INNER JOIN
-                pname2pid_angebote pa ON (pa.produktID = pm.id)
-            INNER JOIN
-                kategorien k ON (k.id = pm.kategorieID)
-            INNER JOIN
-                hersteller h ON(h.id = pm.herstellerID)
-            WHERE
-                pr.pos = 1 AND
-                pr.groesse = 'S'
-        """
+        sql_query = serial_query(products_query)
 
         # sql_query = """
         #     SELECT
@@ -107,7 +121,7 @@ def query():
 
     except mysql.connector.Error as e:
         print("Failed to query table in MySQL: {}".format(e))
-        return []
+        raise
 
     finally:
         if initial_db and initial_db.is_connected():
@@ -115,9 +129,24 @@ def query():
             initial_db.close()
 
 
+def stream_query():
+    # the ranges go to the pipeline as they come in instead of being collected first
+    if workers > 1:
+        yield from parallel_query(
+            products_query,
+            key_column="pm.id",
+            key_table="pname2pid_mapping",
+            workers=workers,
+            limit_count=limit_count
+        )
+        return
+
+    yield from query()
+
+
 def connect_elasticsearch():
     _es = None
-    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, bulk_size=10000)
+    _es = Elasticsearch(['search.testbericht.de'], scheme="https", port=443, timeout=5000.0, maxsize=max_connections)
     if _es.ping():
         print('Connect to Elasticsearch')
     else:
@@ -128,51 +157,11 @@ def connect_elasticsearch():
 def create_index(es_object, index_name):
     created = False
 
-    settings = {
-        "settings": {
-            "number_of_shards": 4,
-            "number_of_replicas": 1
-        },
-        "mappings": {
-            "properties": {
-                "dynamic": "strict",
-                "id": {
-                    "type": "long",
-                },
-                "name": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                },
-                "url": {
-                    "type": "text",
-                },
-                "img": {
-                    "type": "text",
-                },
-                "test": {
-                    "type": "long",
-                },
-                "score": {
-                    "type": "long",
-                },
-                "points": {
-                    "type": "long",
-                },
-                "keyword": {
-                    "type": "text",
-                    "fielddata": {
-                        "loading": "eager"
-                    }
-                }
-            }
-        }
-    }
-
     try:
         if not es_object.indices.exists(index_name):
-            es_object.indices.create(index=index_name, ignore=400, body=settings)
+            # mappings and settings come from the template of the alias, the shard count from the expected volume
+            put_template(es_object, 'products')
+            es_object.indices.create(index=index_name, ignore=400, body=create_settings(es_object, 'products'))
         created = True
     except Exception as ex:
         print(str(ex))
@@ -192,55 +181,52 @@ def get_index_name(es_object, index_name):
         return exist
 
 
-def main():
-    print("=========== Start Products ===========")
-
-    start_time = time.time()
+product_fields = [
+    (0, "id", "id"),
+    (1, "name", "str"),
+    (2, "url", "str"),
+    (3, "img", "str"),
+    (4, "test", "int"),
+    (5, "score", "int"),
+    (6, "points", "int"),
+    (7, "keyword", "str"),
+]
 
-    es_object = connect_elasticsearch()
+to_product = compile_fields(product_fields, "to_product")
 
-    if get_index_name(es_object=es_object, index_name=new_index):
-        ind_name = old_index
-        remove_name = new_index
-    else:
-        ind_name = new_index
-        remove_name = old_index
-    create_index(es_object=es_object, index_name=ind_name)
 
-    records = query()
-    query_time = time.time()
-    delta_query = query_time - start_time
-    print("--- Query: {:10.1f} seconds ---".format(delta_query))
+def join_dimensions(records):
+    kategorien = get_dimension("kategorien")
+    hersteller = get_dimension("hersteller")
 
-    products = []
     for record in records:
-        row = {
-            "id": int(record[0]),
-            "name": record[1] if record[1] else "",
-            "url": record[2] if record[2] else "",
-            "img": record[3] if record[3] else "",
-            "test": int(record[4]) if record[4] else 0,
-            "score": int(record[5]) if record[5] else 0,
-            "points": int(record[6]) if record[6] else 0,
-            "keyword": record[7] if record[7] else ""
-        }
-
-        products.append(row)
-
-    json_time = time.time()
-    delta_json = json_time - query_time
-    print("--- Json: {:10.1f} seconds ---".format(delta_json))
-
-    helpers.bulk(es_object, products, index=ind_name)
+        k = kategorien.get(record[7])
+        h = hersteller.get(record[8])
+        if k is None or h is None:
+            continue
+
+        yield tuple(record[:7]) + (concat(k.kategorieName, ", ", h.HERSTELLERNAME),)
+
+
+def generate_products(records):
+    for record in join_dimensions(records):
+        yield to_product(record)
+
+
+def main(es_object=None):
+    print("=========== Start Products ===========")
+
+    es_object = es_object or connect_elasticsearch()
+
+    ind_name = new_generation('products')
+    create_index(es_object=es_object, index_name=ind_name)
+
+    imported, _ = run_pipeline(es_object, stream_query, generate_products, index=ind_name, alias='products', keyed=True)
     elastic_time = time.time()
-    delta_elastic = elastic_time - json_time
-    print("--- Elastic: {:10.1f} seconds ---".format(delta_elastic))
-    print("--- Total: {:10.1f} seconds ---".format(delta_query + delta_json + delta_elastic))
-    print("Imported Records:", len(products))
-
-    add_alias(option='products', add_index=ind_name)
-    if get_index_name(es_object, remove_name):
-        es_object.indices.delete(index=remove_name, ignore=[400, 404])
+    print("Imported Records:", imported)
+
+    finish_load(es_object, ind_name, alias='products')
+    swap_alias(es_object, 'products', ind_name, remove_indices=expired_generations(es_object, 'products'))
     alias_time = time.time()
     delta_alias = alias_time - elastic_time
     print("--- Alias: {:10.1f} seconds ---".format(delta_alias))
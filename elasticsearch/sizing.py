@@ -0,0 +1,68 @@
+import math
+
+from extract import fetch_all
+
+# primary store per shard the shard count aims for, and the room a generation gets to grow
+target_shard_bytes = 20 * 1024 * 1024 * 1024
+growth = 1.25
+max_shards = 8
+
+# for the pre-flight when there is no previous generation yet: the table the documents come from
+# (one document per row at most) and the average primary store per document
+volume_estimates = {
+    "items": ("pname2pid_mapping", 20000),
+    "products": ("pname2pid_mapping", 600),
+    "prices": ("pname2pid_angebote", 100),
+    "keywords": ("filter_namen", 300),
+    "filters": ("filter_namen", 600),
+    "herstellerfilters": ("filter2hersteller_anzahl", 700),
+    "filterherstellers": ("filter_hersteller", 300),
+    "filterkombis": ("filter_kombinieren", 400),
+    "filtermagazinekats": ("tester_kategorien", 300),
+    "filtermagazines": ("tester", 200),
+    "testreihes": ("tester_testreihen", 200),
+    "kategorien": ("kategorien", 200),
+    "hersteller": ("hersteller", 200),
+    "producers": ("hersteller", 200),
+    "categories": ("agents", 200),
+}
+
+
+def previous_size(es_object, alias):
+    # primary docs and store of the generation the alias points to now, None before the first load
+    stats = es_object.indices.stats(index=alias, metric="docs,store", ignore=404)
+    primaries = stats.get("_all", {}).get("primaries", {})
+    if not primaries.get("docs", {}).get("count"):
+        return None
+    return primaries["docs"]["count"], primaries["store"]["size_in_bytes"]
+
+
+def estimated_size(alias):
+    if alias not in volume_estimates:
+        return None
+
+    table, document_bytes = volume_estimates[alias]
+    count = int(fetch_all("SELECT COUNT(*) FROM {}".format(table))[0][0])
+    return count, count * document_bytes
+
+
+def shard_count(es_object, alias, default=1):
+    source = "previous generation"
+    try:
+        size = previous_size(es_object, alias)
+        if size is None:
+            source = "COUNT(*)"
+            size = estimated_size(alias)
+    except Exception as ex:
+        print("Shard sizing for {} failed: {}".format(alias, ex))
+        size = None
+
+    if size is None:
+        return default
+
+    count, store_bytes = size
+    shards = max(1, min(max_shards, math.ceil(store_bytes * growth / target_shard_bytes)))
+    print("Shards {}: {} for {} documents, {:.1f} MB from the {}".format(
+        alias, shards, count, store_bytes / 1024 / 1024, source
+    ))
+    return shards
@@ -0,0 +1,264 @@
+import os
+import json
+import mmap
+import pickle
+import shutil
+import bisect
+import hashlib
+from array import array
+
+import mysql.connector
+
+from dimensions import text
+from extract import fetch_all, get_connection, get_pool
+
+snapshot_dir = os.path.join(os.path.dirname(__file__), 'snapshots')
+
+# rows per row group, every group picks its own column types
+group_rows = 50000
+keep_snapshots = 2
+
+
+update_times_query = """
+SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})
+"""
+
+
+def table_checksums(tables):
+    # reads every row of an InnoDB table, only used where there is no update time
+    return {text(record[0]): record[1] for record in fetch_all("CHECKSUM TABLE {}".format(", ".join(tables)))}
+
+
+def table_update_times(tables):
+    initial_db = get_connection(get_pool(1))
+
+    try:
+        initial_cursor = initial_db.cursor()
+        try:
+            # MySQL 8 caches these statistics for a day by default, 5.7 and MariaDB read them live
+            initial_cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+        except mysql.connector.Error:
+            pass
+        initial_cursor.execute(update_times_query.format(", ".join(["%s"] * len(tables))), tuple(tables))
+        records = initial_cursor.fetchall()
+        initial_cursor.close()
+        return {text(record[0]): record[1] for record in records}
+    finally:
+        initial_db.close()
+
+
+def table_versions(tables):
+    # the UPDATE_TIME of InnoDB is kept in memory: it is NULL after a server restart until the next
+    # write, and always NULL for tables in the system tablespace; those tables fall back to
+    # CHECKSUM TABLE, everything else costs one information_schema lookup
+    versions = {table: ("updated", value) for table, value in table_update_times(tables).items() if value is not None}
+    unknown = [table for table in tables if table not in versions]
+    if unknown:
+        versions.update((table, ("checksum", value)) for table, value in table_checksums(unknown).items())
+    return versions
+
+
+def snapshot_key(key_parts, tables):
+    digest = hashlib.sha1()
+    for part in key_parts:
+        digest.update(str(part).encode())
+    digest.update(json.dumps(table_versions(tables), sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def column_kind(values):
+    kinds = set(type(value) for value in values if value is not None)
+
+    if not kinds:
+        return "int"
+    if kinds == {int}:
+        return "int"
+    if kinds <= {int, float}:
+        return "float"
+    if kinds == {str}:
+        return "str"
+    if kinds <= {bytes, bytearray}:
+        return "bytes"
+    return "object"
+
+
+def encode(kind, value):
+    if kind == "str":
+        return value.encode()
+    if kind == "bytes":
+        return bytes(value)
+    return pickle.dumps(value)
+
+
+class SnapshotWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.groups = []
+        self.pending = []
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+    def append(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        group = len(self.groups)
+        columns = list(zip(*self.pending))
+        kinds = []
+
+        for position, values in enumerate(columns):
+            kind = column_kind(values)
+            kinds.append(kind)
+            name = os.path.join(self.tmp_path, "g{}_c{}".format(group, position))
+
+            with open(name + '.null', 'wb') as null_file:
+                null_file.write(bytes(value is None for value in values))
+
+            if kind == "int":
+                with open(name + '.val', 'wb') as value_file:
+                    array('q', (0 if value is None else value for value in values)).tofile(value_file)
+            elif kind == "float":
+                with open(name + '.val', 'wb') as value_file:
+                    array('d', (0.0 if value is None else float(value) for value in values)).tofile(value_file)
+            else:
+                offsets = array('q')
+                end = 0
+                with open(name + '.dat', 'wb') as data_file:
+                    for value in values:
+                        if value is not None:
+                            data = encode(kind, value)
+                            data_file.write(data)
+                            end += len(data)
+                        offsets.append(end)
+                with open(name + '.off', 'wb') as offset_file:
+                    offsets.tofile(offset_file)
+
+        self.groups.append({"rows": len(self.pending), "kinds": kinds})
+        self.pending = []
+
+    def close(self):
+        self.flush()
+
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w') as meta_file:
+            json.dump({"groups": self.groups}, meta_file)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def map_file(path):
+    with open(path, 'rb') as mapped_file:
+        if os.fstat(mapped_file.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+class Snapshot:
+    # read-only view of a snapshot, the column files stay memory-mapped and rows are built on access
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+
+        self.groups = []
+        self.starts = []
+        total = 0
+
+        for group, group_meta in enumerate(meta["groups"]):
+            columns = []
+            for position, kind in enumerate(group_meta["kinds"]):
+                name = os.path.join(path, "g{}_c{}".format(group, position))
+                nulls = map_file(name + '.null')
+                if kind == "int":
+                    columns.append((kind, nulls, map_file(name + '.val').cast('q'), None))
+                elif kind == "float":
+                    columns.append((kind, nulls, map_file(name + '.val').cast('d'), None))
+                else:
+                    columns.append((kind, nulls, map_file(name + '.off').cast('q'), map_file(name + '.dat')))
+
+            self.groups.append(columns)
+            self.starts.append(total)
+            total += group_meta["rows"]
+
+        self.rows = total
+
+    def __len__(self):
+        return self.rows
+
+    def value(self, column, row):
+        kind, nulls, values, data = column
+
+        if nulls[row]:
+            return None
+        if data is None:
+            return values[row]
+
+        start = values[row - 1] if row else 0
+        raw = data[start:values[row]]
+        if kind == "str":
+            return str(raw, 'utf-8')
+        if kind == "bytes":
+            return raw.tobytes()
+        return pickle.loads(raw)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+
+        group = bisect.bisect_right(self.starts, row) - 1
+        row -= self.starts[group]
+        return tuple(self.value(column, row) for column in self.groups[group])
+
+    def __iter__(self):
+        for group, columns in enumerate(self.groups):
+            rows = (self.starts[group + 1] if group + 1 < len(self.starts) else self.rows) - self.starts[group]
+            for row in range(rows):
+                yield tuple(self.value(column, row) for column in columns)
+
+
+def cleanup(name_dir, keep):
+    snapshots = sorted(
+        (entry for entry in os.listdir(name_dir) if not entry.endswith('.tmp')),
+        key=lambda entry: os.path.getmtime(os.path.join(name_dir, entry)),
+        reverse=True
+    )
+    for entry in snapshots[keep:]:
+        shutil.rmtree(os.path.join(name_dir, entry), ignore_errors=True)
+
+
+def cached_query(name, key_parts, tables, fetch):
+    # fetch() is only called when there is no snapshot for this query and these table versions yet
+    name_dir = os.path.join(snapshot_dir, name)
+    path = os.path.join(name_dir, snapshot_key(key_parts, tables))
+
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        snapshot = Snapshot(path)
+        print("Snapshot reused: {} ({} records)".format(path, len(snapshot)))
+        return snapshot
+
+    writer = SnapshotWriter(path)
+    try:
+        for record in fetch():
+            writer.append(record)
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.close()
+    cleanup(name_dir, keep_snapshots)
+    print("Snapshot written: {}".format(path))
+    return Snapshot(path)
@@ -0,0 +1,309 @@
+import json
+import hashlib
+
+from generations import generation_pattern
+from indexsort import sort_settings
+from mappings import sortable_text
+from sizing import shard_count
+
+# every <alias>-<timestamp> generation is created from the template of its alias, a template
+# is only written again when its content hash changed; create_index() does not pass any settings
+
+# new indices start without replicas and refresh, lifecycle.finish_load switches them to serving settings
+loading_settings = {
+    "number_of_replicas": 0,
+    "refresh_interval": "-1",
+}
+
+# above the priority of the built-in templates, so nothing else gets merged into our indices
+priority = 200
+
+star_histogram = {
+    "properties": {
+        "count": {"type": "long"},
+        "mean": {"type": "double"},
+        "star1": {"type": "long"},
+        "star2": {"type": "long"},
+        "star3": {"type": "long"},
+        "star4": {"type": "long"},
+        "star5": {"type": "long"},
+    }
+}
+
+# per alias: shards (only used when sizing.shard_count has nothing to go by), properties and optionally analysis (custom analyzers) and further index settings
+index_templates = {
+    "items": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "PNAME": sortable_text(),
+            "PURL": {"type": "text"},
+            "DATENBLATT": {"type": "text"},
+            "DATENBLATTDETAILS": {"type": "text"},
+            "IMG": {"type": "text"},
+            "MAN": {"type": "text"},
+            "EAN": {"type": "text"},
+            "CONTENT": {"type": "text"},
+            "TESTCONTENT": {"type": "text"},
+            "SCORE": {"type": "long"},
+            "TESTS": {"type": "long"},
+            "TESTPRO": {"type": "text"},
+            "TESTCONTRA": {"type": "text"},
+            "TESTSIEGER": {"type": "long"},
+            "PREISSIEGER": {"type": "long"},
+            "MEINUNGENSCORE": {"type": "text"},
+            "MEINUNGEN": {"type": "long"},
+            "meinungenPunkte": {"type": "double"},
+            "AMAZONMEINUNGEN": {"type": "long"},
+            "serienZusatz": {"type": "text"},
+            "energieEffizienzKlasse": {"type": "text"},
+            "noIndex": {"type": "short"},
+            "noIndex2": {"type": "short"},
+            "anzAngebote": {"type": "long"},
+            "preis": {"type": "long"},
+            "sortPos": {"type": "long"},
+            "noIndexKategorie": {"type": "short"},
+            "kategorieURL": {"type": "text"},
+            "bildPfad": {"type": "text"},
+            "breite": {"type": "long"},
+            "hoehe": {"type": "long"},
+            "starsAmazon": star_histogram,
+            "starsOtto": star_histogram,
+            "starsTBDE": star_histogram,
+        },
+    },
+    "products": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "name": sortable_text(),
+            "url": {"type": "text"},
+            "img": {"type": "text"},
+            "test": {"type": "long"},
+            "score": {"type": "long"},
+            "points": {"type": "long"},
+            "keyword": sortable_text(),
+        },
+    },
+    "prices": {
+        "shards": 1,
+        "properties": {
+            "id": {"type": "long"},
+            "price": sortable_text(),
+        },
+    },
+    "keywords": {
+        "shards": 1,
+        "properties": {
+            "title": sortable_text(),
+            "url": sortable_text(),
+            "id": {"type": "long"},
+            "anzahl": {"type": "long"},
+        },
+    },
+    "filters": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "Title": sortable_text(),
+            "anzeige": {"type": "text"},
+            "url": {"type": "text"},
+            "filterURL": {"type": "text"},
+            "fnAnzeigeKategorie": {"type": "short"},
+            "noIndexFN": {"type": "short"},
+            "anzahl": {"type": "short"},
+            "name": {"type": "text"},
+            "fkAnzeigeKategorie": {"type": "short"},
+            "noIndexFK": {"type": "short"},
+            "kategorieURL": {"type": "text"},
+            "kategorieName": {"type": "text"},
+        },
+    },
+    "herstellerfilters": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "Title": sortable_text(),
+            "anzeige": {"type": "text"},
+            "url": {"type": "text"},
+            "filterURL": {"type": "text"},
+            "fnAnzeigeKategorie": {"type": "short"},
+            "noIndexFN": {"type": "short"},
+            "name": {"type": "text"},
+            "fkAnzeigeKategorie": {"type": "short"},
+            "noIndexFK": {"type": "short"},
+            "HERSTELLERNAME": sortable_text(facet=True),
+            "URLSTRUKTUR": {"type": "text"},
+            "anzahl": {"type": "long"},
+            "kategorieURL": {"type": "text"},
+            "kategorieName": {"type": "text"},
+        },
+    },
+    "filterherstellers": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "HERSTELLERNAME": sortable_text(facet=True),
+            "URLSTRUKTUR": {"type": "text"},
+            "anzahl": {"type": "long"},
+            "kategorieURL": {"type": "text"},
+            "kategorieName": {"type": "text"},
+        },
+    },
+    "kategorien": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "kategorieURL": sortable_text(facet=True),
+            "kategorieName": {"type": "text"},
+            "catNoIndex": {"type": "short"},
+        },
+    },
+    "hersteller": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "HERSTELLERNAME": sortable_text(facet=True),
+            "URLSTRUKTUR": {"type": "text"},
+            "anzahl": {"type": "long"},
+        },
+    },
+    "producers": {
+        "shards": 1,
+        "properties": {
+            "title": sortable_text(),
+            "url": sortable_text(),
+        },
+    },
+    "categories": {
+        "shards": 1,
+        "properties": {
+            "title": sortable_text(),
+            "url": sortable_text(),
+            "img": sortable_text(),
+        },
+    },
+    "filtermagazines": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "testerURL": sortable_text(facet=True),
+            "testerName": {"type": "text"},
+            "anz": {"type": "long"},
+        },
+    },
+    "filtermagazinekats": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "testerURL": sortable_text(facet=True),
+            "testerName": {"type": "text"},
+            "kategorieURL": {"type": "text"},
+            "kategorieName": {"type": "text"},
+            "anz": {"type": "long"},
+        },
+    },
+    "testreihes": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "ueberschrift": sortable_text(),
+            "noIndex": {"type": "long"},
+            "testerURL": sortable_text(facet=True),
+            "anzahl": {"type": "long"},
+        },
+    },
+    "filterkombis": {
+        "shards": 4,
+        "properties": {
+            "id": {"type": "long"},
+            "title": sortable_text(),
+            "anzahl": {"type": "long"},
+            "noIndex": {"type": "short"},
+            "url": {"type": "text"},
+            "kategorieURL": {"type": "text"},
+        },
+    },
+}
+
+# content hash of the template each alias was last checked against in this process
+checked = {}
+
+
+def template_name(alias):
+    return "indexer-{}".format(alias)
+
+
+def index_patterns(alias):
+    return [generation_pattern(alias)]
+
+
+def template_content(alias):
+    definition = index_templates[alias]
+
+    settings = {"number_of_shards": definition["shards"]}
+    settings.update(loading_settings)
+    settings.update(definition.get("settings", {}))
+    index = sort_settings(alias)
+    if index:
+        settings["index"] = index
+    if "analysis" in definition:
+        settings["analysis"] = definition["analysis"]
+
+    return {
+        "settings": settings,
+        "mappings": {
+            "dynamic": "strict",
+            "properties": definition["properties"],
+        },
+    }
+
+
+def template_hash(content):
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def template_body(alias):
+    content = template_content(alias)
+    digest = template_hash(content)
+
+    # the hash also goes into the mapping _meta, so every index tells which template built it
+    content["mappings"]["_meta"] = {"template": template_name(alias), "hash": digest}
+    return digest, {
+        "index_patterns": index_patterns(alias),
+        "priority": priority,
+        "template": content,
+        "_meta": {"hash": digest},
+    }
+
+
+def response_hash(response):
+    for template in response.get("index_templates", []):
+        return template["index_template"].get("_meta", {}).get("hash")
+    return None
+
+
+def installed_hash(es_object, alias):
+    return response_hash(es_object.indices.get_index_template(name=template_name(alias), ignore=404))
+
+
+def put_template(es_object, alias):
+    digest, body = template_body(alias)
+    if checked.get(alias) == digest:
+        return digest
+
+    if installed_hash(es_object, alias) != digest:
+        es_object.indices.put_index_template(name=template_name(alias), body=body)
+        print("Template {} updated: {}".format(template_name(alias), digest))
+
+    checked[alias] = digest
+    return digest
+
+
+def create_settings(es_object, alias):
+    # the part the template can not know in advance, passed to indices.create on top of it
+    return {
+        "settings": {
+            "number_of_shards": shard_count(es_object, alias, default=index_templates[alias]["shards"])
+        }
+    }
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules are flat scripts next to this directory; appended, not prepended, because keyword.py
+# would shadow the standard library module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
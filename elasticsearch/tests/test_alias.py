@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("elasticsearch7")
+
+import alias  # noqa: E402
+from alias import commit_swaps, defer_swaps, discard_swaps, swap_alias  # noqa: E402
+
+
+class Indices:
+
+    def __init__(self):
+        self.updates = []
+        self.mappings = {}
+
+    def get_alias(self, name, ignore=None):
+        return {"items-1": {"aliases": {"items": {}}}}
+
+    def get_mapping(self, index, filter_path=None):
+        return {"items-2": {"mappings": {"_meta": {"template": "items", "hash": "abc"}}}}
+
+    def put_mapping(self, index, body):
+        self.mappings[index] = body
+
+    def update_aliases(self, body):
+        self.updates.append(body["actions"])
+
+    def delete(self, index, ignore=None):
+        pass
+
+
+class Client:
+
+    def __init__(self):
+        self.indices = Indices()
+
+
+@pytest.fixture(autouse=True)
+def no_deferred_swaps():
+    yield
+    alias.deferred = None
+
+
+def test_after_swap_runs_with_the_swap():
+    es_object = Client()
+    marks = []
+
+    swap_alias(es_object, "items", "items-2", after_swap=lambda: marks.append("items"))
+
+    assert marks == ["items"]
+    assert len(es_object.indices.updates) == 1
+
+
+def test_swapped_index_is_marked_live():
+    es_object = Client()
+
+    swap_alias(es_object, "items", "items-2")
+
+    # the template hash stays in the _meta
+    assert es_object.indices.mappings == {"items-2": {"_meta": {"template": "items", "hash": "abc", "live": True}}}
+
+
+def test_after_swap_waits_for_the_commit():
+    es_object = Client()
+    marks = []
+    defer_swaps()
+
+    swap_alias(es_object, "items", "items-2", after_swap=lambda: marks.append("items"))
+    assert marks == []
+
+    commit_swaps(es_object)
+    assert marks == ["items"]
+
+
+def test_discarded_swaps_keep_the_mark():
+    es_object = Client()
+    marks = []
+    defer_swaps()
+
+    swap_alias(es_object, "items", "items-2", after_swap=lambda: marks.append("items"))
+    discard_swaps()
+
+    assert marks == []
+    assert es_object.indices.updates == []
+    assert es_object.indices.mappings == {}
@@ -0,0 +1,104 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("elasticsearch7")
+pytest.importorskip("dotenv")
+
+import cdc  # noqa: E402
+import loader  # noqa: E402
+
+
+class BulkClient:
+    # answers every bulk request, the ids in rejected fail with a mapping error that is not retried
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.requests = []
+
+    def bulk(self, body, index=None, filter_path=None):
+        lines = [json.loads(line) for line in body.decode().splitlines() if line]
+        self.requests.append(lines)
+
+        items = []
+        failed = False
+        position = 0
+        while position < len(lines):
+            op_type, meta = next(iter(lines[position].items()))
+            position += 1 if op_type == "delete" else 2
+            if int(meta["_id"]) in self.rejected:
+                items.append({op_type: {"status": 400, "error": {"type": "mapper_parsing_exception"}}})
+                failed = True
+            else:
+                items.append({op_type: {"status": 200}})
+
+        return {"took": 1, "errors": failed, "items": items}
+
+
+class RecordingSource(cdc.FileEventSource):
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.commits = []
+
+    def commit(self, position):
+        self.commits.append(position)
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    # three price events from the binlog, product 7 is gone from the index query by now
+    events = [
+        {"table": "pname2pid_angebote", "before": None, "after": {"produktID": 5}, "position": {"log_file": "binlog.1", "log_pos": 10}},
+        {"table": "pname2pid_angebote", "before": {"produktID": 6}, "after": {"produktID": 6}, "position": {"log_file": "binlog.1", "log_pos": 20}},
+        {"table": "pname2pid_angebote", "before": {"produktID": 7}, "after": None, "position": {"log_file": "binlog.1", "log_pos": 30}},
+    ]
+    events_path = tmp_path / "events.ndjson"
+    events_path.write_text("".join(json.dumps(event) + "\n" for event in events))
+
+    fetched = []
+
+    def fetch_ids(sql_query, key_column, ids):
+        fetched.append((sql_query, key_column, set(ids)))
+        return [(produkt_id, 9.99) for produkt_id in sorted(ids) if produkt_id != 7]
+
+    script = SimpleNamespace(
+        prices_query="SELECT produktID, preis FROM pname2pid_angebote WHERE {range}",
+        generate_prices=lambda records: ({"id": record[0], "preis": record[1]} for record in records),
+    )
+
+    monkeypatch.setattr(cdc, "routes", {"pname2pid_angebote": [("produktID", None, ("prices",))]})
+    monkeypatch.setattr(cdc, "fetch_ids", fetch_ids)
+    monkeypatch.setattr(cdc, "load_script", lambda name: script)
+    monkeypatch.setattr(loader, "dead_letter_dir", str(tmp_path / "dead_letters"))
+
+    return RecordingSource(str(events_path)), fetched, tmp_path
+
+
+def test_replay_updates_and_deletes(replay):
+    source, fetched, _ = replay
+    es_object = BulkClient()
+
+    cdc.consume(source, es_object)
+
+    # the query still carries its {range} marker, fetch_ids puts the ids there
+    assert fetched == [("SELECT produktID, preis FROM pname2pid_angebote WHERE {range}", "produktID", {5, 6, 7})]
+    operations = [(next(iter(line)), next(iter(line.values()))["_id"]) for lines in es_object.requests for line in lines if "doc" not in line]
+    assert sorted(operations) == [("delete", 7), ("update", 5), ("update", 6)]
+    assert source.commits == [{"log_file": "binlog.1", "log_pos": 30}]
+
+
+def test_rejected_document_goes_to_dead_letters(replay):
+    source, _, tmp_path = replay
+    es_object = BulkClient(rejected={6})
+
+    cdc.consume(source, es_object)
+
+    # the position moves on, the rejected document is in the spool instead of replaying forever
+    assert source.commits == [{"log_file": "binlog.1", "log_pos": 30}]
+    spooled = [json.loads(line) for path in (tmp_path / "dead_letters").iterdir() for line in path.read_text().splitlines()]
+    assert len(spooled) == 1
+    assert spooled[0]["alias"] == "prices"
+    assert json.loads(spooled[0]["action"].splitlines()[0])["update"]["_id"] == 6
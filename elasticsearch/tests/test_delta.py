@@ -0,0 +1,45 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("elasticsearch7")
+pytest.importorskip("dotenv")
+
+from delta import load_mark, save_mark  # noqa: E402
+from extract import ids_query  # noqa: E402
+from indexers import load_script  # noqa: E402
+
+
+@pytest.mark.parametrize("script, query_name, key_column", [
+    ("getAllItems", "items_query", "p.id"),
+    ("price", "prices_query", "produktID"),
+])
+def test_delta_queries_take_the_changed_ids(script, query_name, key_column):
+    # the delta runs hand the raw query to fetch_ids, one placeholder per changed id
+    sql_query = getattr(load_script(script), query_name)
+
+    result = ids_query(sql_query, key_column, 1000)
+
+    assert result.count("%s") == 1000
+    assert "{} IN (%s".format(key_column) in result
+
+
+def test_marks_saved_from_threads_are_all_kept(tmp_path):
+    # every writer reads the state under the lock, no save drops another one's mark
+    path = str(tmp_path / "delta_state.json")
+    aliases = ["alias{}".format(number) for number in range(8)]
+
+    def save_marks(alias):
+        for mark in range(20):
+            save_mark(alias, mark, path)
+
+    threads = [threading.Thread(target=save_marks, args=(alias,)) for alias in aliases]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert {alias: load_mark(alias, path) for alias in aliases} == {alias: 19 for alias in aliases}
+    assert sorted(os.listdir(str(tmp_path))) == ["delta_state.json", "delta_state.json.lock"]
@@ -0,0 +1,153 @@
+import threading
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("dotenv")
+
+from mysql.connector.errors import PoolError  # noqa: E402
+
+import extract  # noqa: E402
+from extract import get_connection, ids_query, merge_join, range_query, serial_query  # noqa: E402
+
+sql_query = """
+    SELECT p.id, p.PNAME FROM pname2pid_mapping p
+    WHERE {range} AND p.gesperrt = 0
+    GROUP BY p.id
+"""
+
+
+def test_ids_query_has_one_placeholder_per_id():
+    result = ids_query(sql_query, "p.id", 3)
+
+    assert "p.id IN (%s, %s, %s) AND p.gesperrt = 0" in result
+    assert result.count("%s") == 3
+    assert "{range}" not in result
+
+
+def test_ids_query_rejects_a_query_without_marker():
+    with pytest.raises(ValueError):
+        ids_query(serial_query(sql_query), "p.id", 3)
+
+
+def test_range_and_serial_query():
+    assert "p.id BETWEEN %s AND %s AND" in range_query(sql_query, "p.id")
+    assert "WHERE 1 = 1 AND" in serial_query(sql_query)
+
+
+def test_merge_join_attaches_each_childs_rows():
+    parents = [(1, "a"), (2, "b"), (3, "c")]
+    reviews = [(1, "r1"), (1, "r2"), (3, "r3")]
+    stars = [(2, 5), (3, 4)]
+
+    result = list(merge_join(parents, [reviews, stars]))
+
+    assert result == [
+        ((1, "a"), [[(1, "r1"), (1, "r2")], []]),
+        ((2, "b"), [[], [(2, 5)]]),
+        ((3, "c"), [[(3, "r3")], [(3, 4)]]),
+    ]
+
+
+def test_merge_join_skips_children_without_parent():
+    # rows of products that are not among the parents, before, between and after them
+    parents = [(2, "b"), (4, "d")]
+    children = [(1, "x"), (2, "r2"), (3, "x"), (4, "r4"), (5, "x")]
+
+    result = list(merge_join(parents, [children]))
+
+    assert result == [((2, "b"), [[(2, "r2")]]), ((4, "d"), [[(4, "r4")]])]
+
+
+def test_merge_join_repeated_parent_keeps_its_children():
+    parents = [(1, "a"), (1, "a2"), (2, "b")]
+    children = [(1, "r1"), (1, "r2"), (2, "r3")]
+
+    result = list(merge_join(parents, [children]))
+
+    assert result == [
+        ((1, "a"), [[(1, "r1"), (1, "r2")]]),
+        ((1, "a2"), [[(1, "r1"), (1, "r2")]]),
+        ((2, "b"), [[(2, "r3")]]),
+    ]
+
+
+def test_merge_join_without_children():
+    assert list(merge_join([(1, "a")], [[], iter(())])) == [((1, "a"), [[], []])]
+    assert list(merge_join([], [[(1, "r1")]])) == []
+
+
+class Cursor:
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def close(self):
+        pass
+
+
+class Pool:
+    # hands out size connections and raises like MySQLConnectionPool when they are all out; it is its
+    # own connection and records the statements run on it
+
+    def __init__(self, size):
+        self.free = size
+        self.lock = threading.Lock()
+        self.statements = []
+
+    def get_connection(self):
+        with self.lock:
+            if not self.free:
+                raise PoolError("Failed getting connection; pool exhausted")
+            self.free -= 1
+            return self
+
+    def cursor(self):
+        return Cursor(self.statements)
+
+    def close(self):
+        with self.lock:
+            self.free += 1
+
+
+def test_get_connection_waits_for_a_free_connection():
+    pool = Pool(1)
+    first = get_connection(pool)
+    threading.Timer(0.2, first.close).start()
+
+    assert get_connection(pool) is pool
+
+
+def test_get_connection_gives_up_after_the_timeout(monkeypatch):
+    monkeypatch.setattr(extract, "acquire_timeout", 0.1)
+    pool = Pool(0)
+
+    with pytest.raises(PoolError):
+        get_connection(pool)
+
+
+def test_get_connection_sets_the_session():
+    # the pool resets the session whenever a connection goes back, so it is set on every checkout
+    pool = Pool(1)
+    get_connection(pool).close()
+    get_connection(pool).close()
+
+    assert pool.statements == [extract.session_query] * 2
+
+
+def test_key_ranges_cover_the_keys():
+    ranges = extract.key_ranges(1, 1000000, 4)
+
+    assert ranges[0][0] == 1 and ranges[-1][1] == 1000000
+    assert all(end + 1 == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+
+def test_key_ranges_are_bounded_by_key_span():
+    # a large table gets more ranges instead of larger ones
+    ranges = extract.key_ranges(1, 1000000, 4)
+
+    assert max(end - start + 1 for start, end in ranges) <= extract.max_range_keys
+    assert len(extract.key_ranges(1, 1000, 4)) == 4 * extract.ranges_per_worker
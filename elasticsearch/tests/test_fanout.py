@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("elasticsearch7")
+pytest.importorskip("dotenv")
+
+import fanout  # noqa: E402
+
+
+@pytest.fixture
+def extraction(monkeypatch):
+    # one builder, small batches on a queue of one, so a builder that stops reading blocks the producer
+    saved = []
+
+    def load_script(name):
+        raise ImportError("No module named {!r}".format(name))
+
+    monkeypatch.setattr(fanout, "builders", [("items", "getAllItems", lambda record: record, "generate_items")])
+    monkeypatch.setattr(fanout, "batch_size", 1)
+    monkeypatch.setattr(fanout, "queue_depth", 1)
+    monkeypatch.setattr(fanout, "put_timeout", 0.01)
+    monkeypatch.setattr(fanout, "connect_elasticsearch", lambda: None)
+    monkeypatch.setattr(fanout, "current_mark", lambda: "2024-01-01 00:00:00")
+    monkeypatch.setattr(fanout, "parallel_query", lambda *args, **kwargs: iter([(number,) for number in range(20)]))
+    monkeypatch.setattr(fanout, "load_script", load_script)
+    monkeypatch.setattr(fanout, "save_mark", lambda alias, mark: saved.append(alias))
+    return saved
+
+
+def test_failed_script_load_does_not_block_the_extraction(extraction):
+    fanout.main()
+
+    assert extraction == []
+
+
+def test_dead_builder_is_no_longer_fed(extraction, monkeypatch):
+    # a builder that returns without reading its queue or setting a result
+    monkeypatch.setattr(fanout, "build", lambda *args: None)
+
+    fanout.main()
+
+    assert extraction == []
@@ -0,0 +1,61 @@
+import pytest
+
+from fields import compile_fields
+
+
+@pytest.mark.parametrize("kind, value, expected", [
+    ("id", 7, 7),
+    ("id", b"7", 7),
+    ("raw", None, None),
+    ("raw", b"x", b"x"),
+    ("str", None, ""),
+    ("str", "", ""),
+    ("str", "x", "x"),
+    # str leaves bytes alone, the serializer decodes them
+    ("str", b"x", b"x"),
+    ("bytes", None, ""),
+    ("bytes", b"", ""),
+    ("bytes", "Grün".encode(), "Grün"),
+    ("int", None, 0),
+    ("int", b"", 0),
+    ("int", b"12", 12),
+    ("int", 0, 0),
+    ("float", None, 0),
+    ("float", b"1.5", 1.5),
+    ("float", 2, 2.0),
+])
+def test_conversions(kind, value, expected):
+    to_document = compile_fields([(0, "value", kind)])
+
+    result = to_document((value,))["value"]
+
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_id_does_not_take_null():
+    to_document = compile_fields([(0, "id", "id")])
+
+    with pytest.raises(TypeError):
+        to_document((None,))
+
+
+@pytest.mark.parametrize("kind, default", [("str", None), ("bytes", "-"), ("int", None), ("float", -1.0)])
+def test_default_for_null(kind, default):
+    to_document = compile_fields([(0, "value", kind, default)])
+
+    assert to_document((None,)) == {"value": default}
+
+
+def test_callable_kind_gets_the_column_value():
+    to_document = compile_fields([(1, "name", lambda value: value.decode().upper() if value else None), (0, "id", "id")])
+
+    assert to_document((3, b"abc", "unused")) == {"name": "ABC", "id": 3}
+    assert to_document((3, None)) == {"name": None, "id": 3}
+
+
+def test_short_record_fails():
+    to_document = compile_fields([(2, "value", "raw")])
+
+    with pytest.raises(ValueError):
+        to_document((1, 2))
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("elasticsearch7")
+
+from generations import removable, split_generations  # noqa: E402
+
+names = ["items-1", "items-2", "items-3", "items-4", "items-5"]
+
+
+def test_unmarked_indices_before_the_first_marked_one_count():
+    # from before the marking came in
+    assert split_generations(names, set()) == (names, [], [])
+    assert split_generations(names, {"items-3"}) == (["items-1", "items-2", "items-3"], [], ["items-4", "items-5"])
+
+
+def test_failed_load_between_marked_ones_is_abandoned():
+    kept, abandoned, pending = split_generations(names, {"items-2", "items-4"})
+
+    assert kept == ["items-1", "items-2", "items-4"]
+    assert abandoned == ["items-3"]
+    assert pending == ["items-5"]
+
+
+def test_failed_load_does_not_push_out_the_last_good_generation():
+    # items-4 failed after create_index, items-5 is the new generation about to be swapped in
+    live = {"items-1", "items-2", "items-3"}
+
+    assert removable("items", names, live) == ["items-1"]
+
+
+def test_abandoned_loads_are_removed():
+    live = {"items-1", "items-2", "items-4", "items-5"}
+
+    assert removable("items", names, live) == ["items-1", "items-3"]
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("elasticsearch7")
+pytest.importorskip("dotenv")
+
+from indexers import load_script  # noqa: E402
+
+items = load_script("getAllItems")
+
+
+def test_star_field_from_group_concat():
+    result = items.star_field(b"5-12|4-3|1-1")
+
+    assert result["count"] == 16
+    assert (result["star1"], result["star4"], result["star5"]) == (1, 3, 12)
+
+
+def test_review_star_field_skips_a_truncated_entry():
+    # GROUP_CONCAT cut off at group_concat_max_len in the middle of the last "id-meinungstern"
+    result = items.review_star_field(b"100111-5|100112-4|100113-")
+
+    assert result["count"] == 2
+    assert (result["star4"], result["star5"]) == (1, 1)
+
+
+def test_star_field_of_merged_histogram():
+    assert items.star_field((0, 0, 0, 1, 2))["mean"] == 4.67
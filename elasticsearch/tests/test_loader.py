@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+pytest.importorskip("elasticsearch7")
+
+from elasticsearch7.exceptions import ConnectionTimeout  # noqa: E402
+
+import loader  # noqa: E402
+from loader import TooManyFailures, parallel_bulk  # noqa: E402
+
+
+class BulkClient:
+    # the documents with an id in rejected fail with a mapping error, which is not retried
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+
+    def bulk(self, body, index=None, filter_path=None):
+        lines = [json.loads(line) for line in body.decode().splitlines() if line]
+        items = []
+        for action in lines[::2]:
+            op_type, meta = next(iter(action.items()))
+            if meta["_id"] in self.rejected:
+                items.append({op_type: {"status": 400, "error": {"type": "mapper_parsing_exception"}}})
+            else:
+                items.append({op_type: {"status": 201}})
+        return {"took": 1, "errors": any(next(iter(item.values()))["status"] >= 300 for item in items), "items": items}
+
+
+class TimingOutClient(BulkClient):
+    # the first request times out after the cluster may already have applied it
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    def bulk(self, body, index=None, filter_path=None):
+        self.requests += 1
+        if self.requests == 1:
+            raise ConnectionTimeout("N/A", "Read timed out", None)
+        return super().bulk(body, index=index, filter_path=filter_path)
+
+
+@pytest.fixture(autouse=True)
+def dead_letters(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, "dead_letter_dir", str(tmp_path))
+    monkeypatch.setattr(loader, "backoff", lambda attempt: 0)
+
+
+def documents(count):
+    return ({"_id": position, "name": "document {}".format(position)} for position in range(count))
+
+
+def test_load_above_the_failure_threshold_is_given_up():
+    with pytest.raises(TooManyFailures):
+        parallel_bulk(BulkClient(rejected={1, 2}), documents(1000), index="items-1", alias="items")
+
+
+def test_load_within_the_failure_threshold_goes_on():
+    success, errors = parallel_bulk(BulkClient(rejected={1}), documents(1000), index="items-1", alias="items")
+
+    assert success == 999
+    assert len(errors) == 1
+
+
+def test_updates_of_the_live_alias_are_not_checked():
+    success, errors = parallel_bulk(BulkClient(rejected={1, 2}), documents(10), alias="items")
+
+    assert (success, len(errors)) == (8, 2)
+
+
+def test_timed_out_keyed_chunk_is_sent_again():
+    es_object = TimingOutClient()
+
+    success, errors = parallel_bulk(es_object, documents(10), index="items-1", alias="items")
+
+    assert (success, errors, es_object.requests) == (10, [], 2)
+
+
+def test_timed_out_chunk_without_ids_fails_the_load():
+    # sent again, every document of it could be indexed twice
+    es_object = TimingOutClient()
+    unkeyed = ({"name": "document {}".format(position)} for position in range(10))
+
+    with pytest.raises(ConnectionTimeout):
+        parallel_bulk(es_object, unkeyed, index="producers-1", alias="producers")
+    assert es_object.requests == 1
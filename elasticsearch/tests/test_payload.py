@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+pytest.importorskip("elasticsearch7")
+
+from payload import PayloadBuilder, action_lines, chunks, failed_items  # noqa: E402
+
+
+def documents(count, size=10):
+    return [{"_id": position, "name": "x" * size} for position in range(count)]
+
+
+def ids(chunk):
+    return [json.loads(chunk.action(position).split(b"\n")[0])["index"]["_id"] for position in range(len(chunk))]
+
+
+def test_action_lines():
+    assert action_lines({"name": "a"}) == b'{"index":{}}\n{"name":"a"}\n'
+    assert action_lines({"_id": 1, "name": "a"}) == b'{"index":{"_id":1}}\n{"name":"a"}\n'
+    assert action_lines({"_op_type": "delete", "_index": "items", "_id": 1}) == b'{"delete":{"_index":"items","_id":1}}\n'
+    assert json.loads(action_lines({"_op_type": "update", "_id": 1, "doc": {"name": "a"}}).split(b"\n")[1]) == {"doc": {"name": "a"}}
+
+
+def test_chunk_stays_below_the_byte_limit():
+    size = len(action_lines(documents(1)[0]))
+
+    result = list(chunks(documents(10), max_bytes=3 * size + 1))
+
+    assert [len(chunk) for chunk in result] == [3, 3, 3, 1]
+    assert all(len(chunk.body) <= 3 * size + 1 for chunk in result)
+    assert [ids(chunk) for chunk in result] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_action_above_the_byte_limit_goes_alone():
+    actions = documents(1) + documents(1, size=1000) + documents(1)
+
+    result = list(chunks(actions, max_bytes=200))
+
+    assert [len(chunk) for chunk in result] == [1, 1, 1]
+
+
+def test_chunk_is_sent_at_max_docs():
+    builder = PayloadBuilder(max_docs=2)
+
+    finished = [builder.add(action) for action in documents(3)]
+
+    assert [chunk is not None for chunk in finished] == [False, True, False]
+    assert ids(finished[1]) == [0, 1]
+    assert ids(builder.flush()) == [2]
+    assert builder.flush() is None
+
+
+def test_select_after_a_partial_failure():
+    chunk = next(chunks(documents(5)))
+    response = {"errors": True, "items": [
+        {"index": {"status": 201}},
+        {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+        {"index": {"status": 201}},
+        {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+        {"index": {"status": 404}},
+    ]}
+
+    failed = failed_items(response, ignore_status=(404,))
+    retry = chunk.select([position for position, _ in failed])
+
+    assert [position for position, _ in failed] == [1, 3]
+    assert ids(retry) == [1, 3]
+    assert retry.body == chunk.action(1) + chunk.action(3)
+    assert list(retry.offsets) == [0, len(chunk.action(1))]
+    assert len(retry.select([1])) == 1 and retry.select([1]).body == chunk.action(3)
+
+
+def test_keyed_needs_an_id_on_every_action():
+    assert next(chunks(documents(3))).keyed
+    assert not next(chunks(documents(2) + [{"name": "x"}])).keyed
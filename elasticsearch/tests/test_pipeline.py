@@ -0,0 +1,80 @@
+import itertools
+import json
+
+import pytest
+
+pytest.importorskip("elasticsearch7")
+
+import loader  # noqa: E402
+from pipeline import Pipeline, PipelineFailed, run_pipeline  # noqa: E402
+
+
+class BulkClient:
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.ids = []
+
+    def bulk(self, body, index=None, filter_path=None):
+        if self.fail:
+            raise ValueError("bulk failed")
+        lines = [json.loads(line) for line in body.decode().splitlines() if line]
+        self.ids.extend(next(iter(action.values())).get("_id") for action in lines[::2])
+        return {"took": 1, "errors": False, "items": [{"index": {"status": 201}} for _ in lines[::2]]}
+
+
+@pytest.fixture(autouse=True)
+def dead_letters(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, "dead_letter_dir", str(tmp_path))
+
+
+def records(count, fail_at=None):
+    for number in range(count):
+        if number == fail_at:
+            raise RuntimeError("Lost connection to MySQL server during query")
+        yield (number, "name {}".format(number))
+
+
+def transform(batch):
+    return [{"id": record[0], "name": record[1]} for record in batch]
+
+
+def test_run_pipeline_loads_every_record():
+    es_object = BulkClient()
+
+    success, errors = run_pipeline(es_object, lambda: records(25), transform, alias="items", keyed=True)
+
+    assert (success, errors) == (25, [])
+    assert sorted(es_object.ids) == list(range(25))
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_failed_extract_fails_the_load(workers):
+    pipeline = Pipeline(lambda: records(25, fail_at=12), transform, batch_size=5, queue_depth=1, workers=workers)
+
+    with pytest.raises(PipelineFailed, match="Query stage failed"):
+        pipeline.run(BulkClient(), alias="items")
+    assert [name for name, _ in pipeline.errors] == ["Query"]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_failed_transform_fails_the_load(workers):
+    def failing_transform(batch):
+        if any(record[0] == 12 for record in batch):
+            raise KeyError("kategorieID")
+        return transform(batch)
+
+    # the extract never ends on its own, it has to notice the stop
+    pipeline = Pipeline(lambda: ((number, "") for number in itertools.count()), failing_transform, batch_size=5, queue_depth=1, workers=workers)
+
+    with pytest.raises(PipelineFailed, match="Json stage failed"):
+        pipeline.run(BulkClient(), alias="items")
+    assert pipeline.errors[0][0] == "Json"
+
+
+def test_failed_bulk_stops_the_other_stages():
+    pipeline = Pipeline(lambda: ((number, "") for number in itertools.count()), transform, batch_size=5, queue_depth=1)
+
+    with pytest.raises(ValueError):
+        pipeline.run(BulkClient(fail=True), alias="items")
+    assert pipeline.stopped.is_set()
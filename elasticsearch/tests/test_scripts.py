@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("elasticsearch7")
+pytest.importorskip("dotenv")
+
+import mysql.connector  # noqa: E402
+
+import dimensions  # noqa: E402
+import extract  # noqa: E402
+from indexers import load_script  # noqa: E402
+
+
+class BrokenPool:
+
+    def get_connection(self):
+        raise mysql.connector.Error("Lost connection to MySQL server during query")
+
+
+@pytest.mark.parametrize("script", ["category", "FilterMagazine", "Filtertestreihe"])
+def test_failed_read_stops_the_run(script, monkeypatch):
+    # an empty result would be indexed and swapped live, the read has to fail instead
+    module = load_script(script)
+    monkeypatch.setattr(module, "get_pool", lambda size: BrokenPool())
+    monkeypatch.setattr(extract, "acquire_timeout", 0)
+
+    with pytest.raises(mysql.connector.Error):
+        module.query()
+
+
+@pytest.fixture
+def broken_database(monkeypatch):
+    # every way the scripts read: the extract pools, their own connection and the shared dimensions
+    def fail(*args, **kwargs):
+        raise mysql.connector.Error("Lost connection to MySQL server during query")
+
+    monkeypatch.setattr(extract, "get_pool", lambda size: BrokenPool())
+    monkeypatch.setattr(extract, "acquire_timeout", 0)
+    monkeypatch.setattr(mysql.connector, "connect", fail)
+    monkeypatch.setattr(dimensions, "fetch_all", fail)
+    dimensions.invalidate()
+    yield
+    dimensions.invalidate()
+
+
+@pytest.mark.parametrize("script", [
+    "getAllItems", "product", "price", "keyword", "producer", "FilterFilter", "FilterFilterHersteller",
+    "FilterFilterkombi", "FilterHerstellerfilter", "FilterHersteller", "FilterKategorien", "FilterMagazineKat",
+])
+@pytest.mark.parametrize("workers", [1, 4])
+def test_every_script_fails_on_a_failed_read(script, workers, broken_database, monkeypatch):
+    module = load_script(script)
+    if hasattr(module, "workers"):
+        monkeypatch.setattr(module, "workers", workers)
+    if hasattr(module, "merge_children"):
+        monkeypatch.setattr(module, "merge_children", False)
+
+    with pytest.raises(mysql.connector.Error):
+        module.query()
+    if hasattr(module, "stream_query"):
+        with pytest.raises(mysql.connector.Error):
+            list(module.stream_query())
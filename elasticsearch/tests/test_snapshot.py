@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("mysql.connector")
+pytest.importorskip("dotenv")
+
+import snapshot  # noqa: E402
+
+
+@pytest.fixture
+def checksummed(monkeypatch):
+    checksummed = []
+
+    def table_checksums(tables):
+        checksummed.extend(tables)
+        return {table: 4711 for table in tables}
+
+    monkeypatch.setattr(snapshot, "table_checksums", table_checksums)
+    return checksummed
+
+
+def test_update_times_need_no_checksum(monkeypatch, checksummed):
+    updated = datetime(2026, 10, 18, 3, 0)
+    monkeypatch.setattr(snapshot, "table_update_times", lambda tables: {table: updated for table in tables})
+
+    versions = snapshot.table_versions(["hersteller", "kategorien"])
+
+    assert versions == {"hersteller": ("updated", updated), "kategorien": ("updated", updated)}
+    assert checksummed == []
+
+
+def test_tables_without_update_time_are_checksummed(monkeypatch, checksummed):
+    # NULL after a server restart, or for tables in the system tablespace
+    updated = datetime(2026, 10, 18, 3, 0)
+    monkeypatch.setattr(snapshot, "table_update_times", lambda tables: {"hersteller": updated, "kategorien": None})
+
+    versions = snapshot.table_versions(["hersteller", "kategorien"])
+
+    assert versions == {"hersteller": ("updated", updated), "kategorien": ("checksum", 4711)}
+    assert checksummed == ["kategorien"]